@@ -158,7 +158,7 @@ Original Comments
 >     - dwh
 """
 
-import math, re, socket, select, string, struct, sys, threading, time, types, array, errno, inspect
+import math, re, socket, select, string, struct, sys, threading, time, types, array, errno, inspect, collections
 from SocketServer import UDPServer, DatagramRequestHandler, ForkingMixIn, ThreadingMixIn, StreamRequestHandler, \
     TCPServer
 from contextlib import closing
@@ -243,6 +243,9 @@ class OSCMessage(object):
     To construct an 'OSC-bundle' from multiple OSCMessage, see OSCBundle!
     
     Additional methods exist for retreiving typetags or manipulating items as (typetag, value) tuples.
+
+    The typetags and encoded arguments are kept in growable bytearrays, so appending is
+    amortized constant time; 'typetags' and 'message' read them as strings.
     """
 
     def __init__(self, address="", *args):
@@ -268,8 +271,24 @@ class OSCMessage(object):
     def clearData(self):
         """Clear any arguments appended so far
         """
-        self.typetags = ","
-        self.message = ""
+        self._typetags = bytearray(",")
+        self._message = bytearray()
+
+    def _getTypetags(self):
+        return str(self._typetags)
+
+    def _setTypetags(self, typetags):
+        self._typetags = bytearray(typetags)
+
+    typetags = property(_getTypetags, _setTypetags, doc="The typetag-string, starting with ','")
+
+    def _getMessage(self):
+        return str(self._message)
+
+    def _setMessage(self, message):
+        self._message = bytearray(message)
+
+    message = property(_getMessage, _setMessage, doc="The encoded arguments")
 
     def append(self, argument, typehint=None):
         """Appends data to the message, updating the typetags based on
@@ -298,22 +317,33 @@ class OSCMessage(object):
         else:
             tag, binary = OSCArgument(argument, typehint)
 
-        self.typetags += tag
-        self.message += binary
+        self._typetags += tag
+        self._message += binary
 
-    def getBinary(self):
-        """Returns the binary representation of the message
+    def getBuffer(self):
+        """Returns the binary representation of the message as a bytearray,
+        which can be handed to socket.sendto() as is
         """
-        binary = OSCString(self.address)
-        binary += OSCString(self.typetags)
-        binary += self.message
+        address = OSCString(self.address)
+        start = len(address)
+        end = start + (len(self._typetags) // 4 + 1) * 4
+
+        binary = bytearray(end + len(self._message))
+        binary[:start] = address
+        binary[start:start + len(self._typetags)] = self._typetags
+        binary[end:] = self._message
 
         return binary
 
+    def getBinary(self):
+        """Returns the binary representation of the message
+        """
+        return str(self.getBuffer())
+
     def __repr__(self):
         """Returns a string containing the decode Message
         """
-        return str(decodeOSC(self.getBinary()))
+        return str(fastDecodeOSC(self.getBinary()))
 
     def __str__(self):
         """Returns the Message's address and contents as a string.
@@ -323,7 +353,7 @@ class OSCMessage(object):
     def __len__(self):
         """Returns the number of arguments appended so far
         """
-        return (len(self.typetags) - 1)
+        return (len(self._typetags) - 1)
 
     def __eq__(self, other):
         """Return True if two OSCMessages have the same address & content
@@ -331,7 +361,7 @@ class OSCMessage(object):
         if not isinstance(other, self.__class__):
             return False
 
-        return (self.address == other.address) and (self.typetags == other.typetags) and (self.message == other.message)
+        return (self.address == other.address) and (self._typetags == other._typetags) and (self._message == other._message)
 
     def __ne__(self, other):
         """Return (not self.__eq__(other))
@@ -376,7 +406,7 @@ class OSCMessage(object):
     def values(self):
         """Returns a list of the arguments appended so far
         """
-        return decodeOSC(self.getBinary())[2:]
+        return fastDecodeOSC(self.getBinary())[2:]
 
     def tags(self):
         """Returns a list of typetags of the appended arguments
@@ -463,8 +493,8 @@ class OSCMessage(object):
         """Returns a deep copy of this OSCMessage
         """
         msg = self.__class__(self.address)
-        msg.typetags = self.typetags
-        msg.message = self.message
+        msg._typetags = bytearray(self._typetags)
+        msg._message = bytearray(self._message)
         return msg
 
     def count(self, val):
@@ -636,9 +666,7 @@ class OSCBundle(OSCMessage):
           - if 'addr' appears in the dict, its value overrides the OSCBundle's address
           - if 'args' appears in the dict, its value(s) become the OSCMessage's arguments
         """
-        if isinstance(argument, OSCMessage):
-            binary = OSCBlob(argument.getBinary())
-        else:
+        if not isinstance(argument, OSCMessage):
             msg = OSCMessage(self.address)
             if type(argument) == types.DictType:
                 if 'addr' in argument:
@@ -648,17 +676,20 @@ class OSCBundle(OSCMessage):
             else:
                 msg.append(argument, typehint)
 
-            binary = OSCBlob(msg.getBinary())
+            argument = msg
 
-        self.message += binary
-        self.typetags += 'b'
+        # an encoded message is always a multiple of 4 bytes long, so the blob needs no padding
+        binary = argument.getBuffer()
+        self._message += struct.pack(">i", len(binary))
+        self._message += binary
+        self._typetags += 'b'
 
-    def getBinary(self):
-        """Returns the binary representation of the message
+    def getBuffer(self):
+        """Returns the binary representation of the bundle as a bytearray
         """
-        binary = OSCString("#bundle")
+        binary = bytearray(OSCString("#bundle"))
         binary += OSCTimeTag(self.timetag)
-        binary += self.message
+        binary += self._message
 
         return binary
 
@@ -681,7 +712,7 @@ class OSCBundle(OSCMessage):
         """Returns a list of the OSCMessages appended so far
         """
         out = []
-        for decoded in decodeOSC(self.getBinary())[2:]:
+        for decoded in fastDecodeOSC(self.getBinary())[2:]:
             out.append(self._reencapsulate(decoded))
 
         return out
@@ -692,7 +723,7 @@ class OSCBundle(OSCMessage):
         if not isinstance(other, self.__class__):
             return False
 
-        return (self.timetag == other.timetag) and (self.typetags == other.typetags) and (self.message == other.message)
+        return (self.timetag == other.timetag) and (self._typetags == other._typetags) and (self._message == other._message)
 
     def copy(self):
         """Returns a deep copy of this OSCBundle
@@ -702,6 +733,63 @@ class OSCBundle(OSCMessage):
         return copy
 
 
+class MessageTemplate(object):
+    """Encodes OSC messages of a fixed shape: one address and typetag-string, and arguments
+    of fixed-size types only ('i', 'f' or 'd').
+
+    The padded address and typetags are encoded once, into a precompiled struct which packs
+    them together with the arguments in a single call:
+      >>> position = MessageTemplate("/position/drone", "fff")
+      >>> position.pack(1.0, 2.0, 3.0) == OSCMessage("/position/drone", [1.0, 2.0, 3.0]).getBinary()
+      True
+
+    MessageTemplate.get() returns a shared template per (address, typetags), built on first use.
+    """
+    templates = {}
+
+    def get(cls, address, typetags):
+        """Returns the shared template for messages to 'address' with the given typetags
+        """
+        template = cls.templates.get((address, typetags))
+
+        if template is None:
+            template = cls.templates[(address, typetags)] = cls(address, typetags)
+
+        return template
+
+    get = classmethod(get)
+
+    def __init__(self, address, typetags):
+        """Instantiate a template for messages to 'address' with the given typetags
+        (with or without the leading ',').
+        """
+        typetags = typetags.lstrip(',')
+
+        for tag in typetags:
+            if tag not in "ifd":
+                raise OSCError("MessageTemplate supports only 'i', 'f' and 'd' arguments, not %r" % tag)
+
+        self.address = address
+        self.typetags = "," + typetags
+        self.head = OSCString(address) + OSCString(self.typetags)
+        self.struct = struct.Struct(">%ds%s" % (len(self.head), typetags))
+        self.size = self.struct.size
+
+    def __repr__(self):
+        return "MessageTemplate(%r, %r)" % (self.address, self.typetags)
+
+    def pack(self, *args):
+        """Returns the binary representation of the message with the given arguments
+        """
+        return self.struct.pack(self.head, *args)
+
+    def pack_into(self, buffer, offset, *args):
+        """Writes the binary representation of the message with the given arguments
+        into the writable 'buffer' (e.g. a reused bytearray) at 'offset'; it takes 'size' bytes.
+        """
+        self.struct.pack_into(buffer, offset, self.head, *args)
+
+
 ######
 #
 # OSCMessage encoding functions
@@ -714,7 +802,7 @@ def OSCString(next):
     The string ends with 1 to 4 zero-bytes ('\x00') 
     """
 
-    OSCstringLength = math.ceil((len(next) + 1) / 4.0) * 4
+    OSCstringLength = (len(next) // 4 + 1) * 4
     return struct.pack(">%ds" % (OSCstringLength), str(next))
 
 
@@ -726,7 +814,7 @@ def OSCBlob(next):
     """
 
     if type(next) in types.StringTypes:
-        OSCblobLength = math.ceil((len(next)) / 4.0) * 4
+        OSCblobLength = (len(next) + 3) // 4 * 4
         binary = struct.pack(">i%ds" % (OSCblobLength), OSCblobLength, next)
     else:
         binary = ""
@@ -847,12 +935,17 @@ def _readTimeTag(data):
     as a TimeTag.
      """
     high, low = struct.unpack(">LL", data[0:8])
-    if (high == 0) and (low <= 1):
-        time = 0.0
-    else:
-        time = int(NTP_epoch + high) + float(low / NTP_units_per_second)
     rest = data[8:]
-    return (time, rest)
+    return (_timeTagValue(high, low), rest)
+
+
+def _timeTagValue(high, low):
+    """Converts the two words of a TimeTag to floating seconds since the Epoch
+    """
+    if (high == 0) and (low <= 1):
+        return 0.0
+
+    return int(NTP_epoch + high) + float(low / NTP_units_per_second)
 
 
 def _readFloat(data):
@@ -923,6 +1016,151 @@ def decodeOSC(data):
     return decoded
 
 
+######
+#
+# Fast OSCMessage decoding
+#
+######
+
+OSCint = struct.Struct(">i")
+OSCfloat = struct.Struct(">f")
+OSCdouble = struct.Struct(">d")
+OSCtimetag = struct.Struct(">LL")
+
+OSCplans = {}  # typetag-string -> Struct unpacking all of its arguments, or None
+OSCplanLimit = 1024  # distinct typetag-strings remembered before starting over
+
+
+def _typetagPlan(typetags):
+    """Returns the Struct unpacking all arguments of the given typetag-string at once,
+    or None if any of them has no fixed size (anything but 'i', 'f' and 'd').
+    Plans are cached per typetag-string.
+    """
+    try:
+        return OSCplans[typetags]
+    except KeyError:
+        pass
+
+    tags = typetags[1:]
+    plan = None
+
+    if not tags.strip("ifd"):
+        plan = struct.Struct(">" + tags)
+
+    if len(OSCplans) >= OSCplanLimit:
+        OSCplans.clear()
+
+    OSCplans[typetags] = plan
+    return plan
+
+
+def _stringAt(data, offset, end):
+    """Reads the (null-terminated, padded) string at 'offset'.
+    Returns the string and the offset following it.
+    """
+    zero = data.find("\0", offset, end)
+    if zero < 0:
+        raise OSCError("unterminated OSC-string at byte %d" % offset)
+
+    return (data[offset:zero], offset + ((zero - offset) // 4 + 1) * 4)
+
+
+def _checkSize(offset, size, end):
+    if offset + size > end:
+        raise OSCError("OSC-packet truncated at byte %d" % offset)
+
+
+def _decodeAt(data, offset, end):
+    """Decodes the OSC-message or -bundle in data[offset:end]
+    """
+    address, offset = _stringAt(data, offset, end)
+    if address.startswith(","):
+        typetags = address
+        address = ""
+    else:
+        typetags = ""
+
+    if address == "#bundle":
+        _checkSize(offset, 8, end)
+        decoded = [address, _timeTagValue(*OSCtimetag.unpack_from(data, offset))]
+        offset += 8
+        while offset < end:
+            _checkSize(offset, 4, end)
+            length = OSCint.unpack_from(data, offset)[0]
+            offset += 4
+            if length < 0:
+                raise OSCError("negative OSC-bundle element size at byte %d" % offset)
+
+            element = min(offset + length, end)
+            decoded.append(_decodeAt(data, offset, element))
+            offset = element
+
+        return decoded
+
+    if offset >= end:
+        return []
+
+    if not len(typetags):
+        typetags, offset = _stringAt(data, offset, end)
+
+    if not typetags.startswith(","):
+        raise OSCError("OSCMessage's typetag-string lacks the magic ','")
+
+    decoded = [address, typetags]
+    plan = _typetagPlan(typetags)
+
+    if plan is not None:
+        _checkSize(offset, plan.size, end)
+        decoded.extend(plan.unpack_from(data, offset))
+        return decoded
+
+    for tag in typetags[1:]:
+        if tag == "i" or tag == "f":
+            _checkSize(offset, 4, end)
+            decoded.append((OSCint if tag == "i" else OSCfloat).unpack_from(data, offset)[0])
+            offset += 4
+        elif tag == "s":
+            value, offset = _stringAt(data, offset, end)
+            decoded.append(value)
+        elif tag == "b":
+            _checkSize(offset, 4, end)
+            length = OSCint.unpack_from(data, offset)[0]
+            if length < 0:
+                raise OSCError("negative OSC-blob size at byte %d" % offset)
+
+            _checkSize(offset + 4, length, end)
+            decoded.append(data[offset + 4:offset + 4 + length])
+            offset += 4 + (length + 3) // 4 * 4
+        elif tag == "d":
+            _checkSize(offset, 8, end)
+            decoded.append(OSCdouble.unpack_from(data, offset)[0])
+            offset += 8
+        elif tag == "t":
+            _checkSize(offset, 8, end)
+            decoded.append(_timeTagValue(*OSCtimetag.unpack_from(data, offset)))
+            offset += 8
+        else:
+            raise OSCError("unsupported OSC-typetag %r" % tag)
+
+    return decoded
+
+
+def fastDecodeOSC(data):
+    """Converts a binary OSC message to a Python list, like decodeOSC().
+
+    The packet is read in place at an advancing offset with precompiled structs; the
+    arguments of messages whose typetags are all 'i', 'f' or 'd' are unpacked by a single
+    struct cached per typetag-string. 'data' may be a string, bytearray or memoryview.
+    Raises OSCError on truncated or malformed packets.
+    """
+    if type(data) is memoryview:
+        data = data.tobytes()
+    elif type(data) is not str:
+        data = str(data)
+
+    return _decodeAt(data, 0, len(data))
+
+
 ######
 #
 # Utility functions
@@ -1205,7 +1443,7 @@ class OSCClient(object):
 
         try:
             self._ensureConnected(address)
-            self.socket.sendall(msg.getBinary())
+            self.socket.sendall(msg.getBuffer())
 
             if self.client_address:
                 self.socket.connect(self.client_address)
@@ -1239,7 +1477,7 @@ class OSCClient(object):
             raise OSCClientError("Timed out waiting for file descriptor")
 
         try:
-            self.socket.sendall(msg.getBinary())
+            self.socket.sendall(msg.getBuffer())
         except socket.error, e:
             if e[0] in (7, 65):  # 7 = 'no address associated with nodename',  65 = 'no route to host'
                 raise e
@@ -1329,9 +1567,61 @@ def getFilterStr(filters):
 OSCtrans = string.maketrans("{,}?", "(|).")
 
 
+class LRUCache(object):
+    """A thread-safe mapping of at most 'size' entries, which drops the least recently used
+    entry to make room for a new one.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        """Returns the entry for 'key' (making it the most recently used), or 'default'
+        """
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                return default
+
+            self.entries[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+OSCpatterns = LRUCache(256)  # address-pattern -> compiled 'regular expression', see getRegEx()
+
+
 def getRegEx(pattern):
     """Compiles and returns a 'regular expression' object for the given address-pattern.
+    The most recently used patterns are kept compiled.
     """
+    expr = OSCpatterns.get(pattern)
+
+    if expr is None:
+        expr = _compileRegEx(pattern)
+        OSCpatterns[pattern] = expr
+
+    return expr
+
+
+def _compileRegEx(pattern):
     # Translate OSC-address syntax to python 're' syntax
     pattern = pattern.replace(".", r"\.")  # first, escape all '.'s in the pattern.
     pattern = pattern.replace("(", r"\(")  # escape all '('s.
@@ -1353,6 +1643,10 @@ class OSCMultiClient(OSCClient):
     This client keeps a dict of 'OSCTargets'. and sends each OSCMessage to each OSCTarget
     The OSCTargets are simply (host, port) tuples, and may be associated with an OSC-address prefix.
     the OSCTarget's prefix gets prepended to each OSCMessage sent to that target.
+
+    Which targets an OSC-address is sent to, and with which prefixed address, is worked out
+    once per address and remembered until the OSCTargets are changed (through the methods
+    of this class). All targets without a prefix are sent the same encoding of a message.
     """
 
     def __init__(self, server=None):
@@ -1362,6 +1656,7 @@ class OSCMultiClient(OSCClient):
         """
         super(OSCMultiClient, self).__init__(server)
         self.targets = {}
+        self._plans = LRUCache(1024)  # OSC-address -> [(target, prefixed OSC-address or None, filtered), ...]
 
     def _searchHostAddr(self, host):
         """Search the subscribed OSCTargets for (the first occurence of) given host.
@@ -1419,6 +1714,8 @@ class OSCMultiClient(OSCClient):
 
             self._updateFilters(self.targets[address][1], filters)
 
+        self._plans.clear()
+
     def setOSCTarget(self, address, prefix=None, filters=None):
         """Add (i.e. subscribe) a new OSCTarget, or change the prefix for an existing OSCTarget.
           the 'address' argument can be a ((host, port) tuple) : The target server address & UDP-port
@@ -1463,6 +1760,8 @@ class OSCMultiClient(OSCClient):
         except KeyError:
             raise NotSubscribedError(address, prefix)
 
+        self._plans.clear()
+
     def delOSCTarget(self, address, prefix=None):
         """Delete the specified OSCTarget from the Client's dict.
         the 'address' argument can be a ((host, port) tuple), or a hostname.
@@ -1549,6 +1848,7 @@ class OSCMultiClient(OSCClient):
         """Erases all OSCTargets from the Client's dict
         """
         self.targets = {}
+        self._plans.clear()
 
     def updateOSCTargets(self, dict):
         """Update the Client's OSCTargets dict with the contents of 'dict'
@@ -1566,6 +1866,8 @@ class OSCMultiClient(OSCClient):
 
             self.targets[(host, port)] = val
 
+        self._plans.clear()
+
     def getOSCTargetStr(self, address):
         """Returns the OSCTarget matching the given address as a ('osc://<host>:<port>[<prefix>]', ['<filter-string>', ...])' tuple.
         'address' can be a (host, port) tuple, or a 'host' (string), in which case the first matching OSCTarget is returned
@@ -1673,6 +1975,19 @@ class OSCMultiClient(OSCClient):
 
         return out
 
+    def _planAddress(self, msg):
+        """Returns the OSCTargets the given OSCMessage's address is sent to, as
+        (target, prefixed OSC-address or None, target has filters) tuples
+        """
+        plan = []
+        for (address, (prefix, filters)) in self.targets.items():
+            if len(filters) and self._filterMessage(filters, msg) is None:
+                continue
+
+            plan.append((address, prefix + msg.address if len(prefix) else None, bool(len(filters))))
+
+        return plan
+
     def send(self, msg, timeout=None):
         """Send the given OSCMessage to all subscribed OSCTargets
           - msg:  OSCMessage (or OSCBundle) to be sent
@@ -1680,41 +1995,123 @@ class OSCMultiClient(OSCClient):
               this call blocks until socket is available for writing. 
         Raises OSCClientError when timing out while waiting for    the socket.
         """
-        for (address, (prefix, filters)) in self.targets.items():
-            if len(filters):
-                out = self._filterMessage(filters, msg)
-                if not out:  # this catches 'None' and empty bundles.
-                    continue
+        if isinstance(msg, OSCBundle):
+            for (address, (prefix, filters)) in self.targets.items():
+                if len(filters):
+                    out = self._filterMessage(filters, msg)
+                    if not out:  # this catches 'None' and empty bundles.
+                        continue
+                else:
+                    out = msg
+
+                if len(prefix):
+                    out = self._prefixAddress(prefix, msg)
+
+                self._sendBinary(out.getBinary(), address, timeout)
+
+            return
+
+        if not isinstance(msg, OSCMessage):
+            raise TypeError("'msg' argument is not an OSCMessage or OSCBundle object")
+
+        plan = self._plans.get(msg.address)
+        if plan is None:
+            plan = self._planAddress(msg)
+            self._plans[msg.address] = plan
+
+        binary = None
+        prefixed = {}
+        for (address, prefixed_address, filtered) in plan:
+            if filtered and not len(msg):
+                continue  # filtered targets are not sent messages without arguments
+
+            if prefixed_address is None:
+                if binary is None:
+                    binary = msg.getBinary()
+                out = binary
             else:
-                out = msg
+                out = prefixed.get(prefixed_address)
+                if out is None:
+                    if binary is None:
+                        binary = msg.getBinary()
+                    # swap the encoded address for the prefixed one
+                    out = OSCString(prefixed_address) + binary[len(OSCString(msg.address)):]
+                    prefixed[prefixed_address] = out
 
-            if len(prefix):
-                out = self._prefixAddress(prefix, msg)
+            self._sendBinary(out, address, timeout)
 
-            binary = out.getBinary()
+    def _sendBinary(self, binary, address, timeout):
+        """Send the given binary OSC-packet to the given (host, port) address
+        """
+        ret = select.select([], [self._fd], [], timeout)
+        try:
+            ret[1].index(self._fd)
+        except:
+            # for the very rare case this might happen
+            raise OSCClientError("Timed out waiting for file descriptor")
 
-            ret = select.select([], [self._fd], [], timeout)
-            try:
-                ret[1].index(self._fd)
-            except:
-                # for the very rare case this might happen
-                raise OSCClientError("Timed out waiting for file descriptor")
+        try:
+            while len(binary):
+                sent = self.socket.sendto(binary, address)
+                binary = binary[sent:]
 
-            try:
-                while len(binary):
-                    sent = self.socket.sendto(binary, address)
-                    binary = binary[sent:]
+        except socket.error, e:
+            if e[0] in (7, 65):  # 7 = 'no address associated with nodename',  65 = 'no route to host'
+                raise e
+            else:
+                raise OSCClientError("while sending to %s: %s" % (str(address), str(e)))
 
-            except socket.error, e:
-                if e[0] in (7, 65):  # 7 = 'no address associated with nodename',  65 = 'no route to host'
-                    raise e
-                else:
-                    raise OSCClientError("while sending to %s: %s" % (str(address), str(e)))
+
+OSCwildcards = re.compile(r"[*?\[\]{}]")
+OSCregexchars = re.compile(r"[+^$|\\]")  # passed through to the 'regular expression' by getRegEx()
+OSCpatternchars = re.compile(r"[*?\[\]{}+^$|\\]")  # either of the above
+
+
+def _splitPattern(pattern):
+    """Splits an address-pattern into its '/'-separated parts, keeping '{..}' and '[..]'
+    groups whole. Returns None if a group contains a '/', or is not closed.
+    """
+    parts = []
+    start = 0
+    group = None
+
+    for i, c in enumerate(pattern):
+        if group:
+            if c == '/':
+                return None
+            if c == group:
+                group = None
+        elif c == '{':
+            group = '}'
+        elif c == '[':
+            group = ']'
+        elif c == '/':
+            parts.append(pattern[start:i])
+            start = i + 1
+
+    if group:
+        return None
+
+    parts.append(pattern[start:])
+    return parts
 
 
 class OSCAddressSpace:
+    """The registered OSC-addresses and their callbacks.
+
+    Messages sent to a plain address are dispatched with a dict lookup. Address-patterns
+    are matched against a trie of the registered addresses' '/'-separated parts, which
+    skips every branch a literal part of the pattern (or a part with only '{..}' and
+    '[..]' groups) rules out. The addresses a pattern matched are remembered in an LRU,
+    until a callback is added or removed.
+    """
+    # decodes incoming packets; decodeOSC is the slower reference implementation
+    decode = staticmethod(fastDecodeOSC)
+
     def __init__(self):
         self.callbacks = {}
+        self._trie = None  # address part -> sub-trie; None -> the address ending there
+        self._matches = LRUCache(256)  # address-pattern -> matching addresses
 
     def addMsgHandler(self, address, callback):
         """Register a handler for an OSC-address
@@ -1734,11 +2131,99 @@ class OSCAddressSpace:
             address = '/' + address.strip('/')
 
         self.callbacks[address] = callback
+        self._addressesChanged()
 
     def delMsgHandler(self, address):
         """Remove the registered handler for the given OSC-address
         """
         del self.callbacks[address]
+        self._addressesChanged()
+
+    def _addressesChanged(self):
+        self._trie = None
+        self._matches.clear()
+
+    def _getTrie(self):
+        trie = self._trie
+
+        if trie is None:
+            trie = {}
+            for addr in self.callbacks.keys():
+                node = trie
+                for part in addr.split('/')[1:]:
+                    node = node.setdefault(part, {})
+                node[None] = addr
+
+            self._trie = trie
+
+        return trie
+
+    def _matchPattern(self, pattern):
+        """Returns the registered addresses matching the given address-pattern
+        """
+        matches = self._matches.get(pattern)
+        if matches is not None:
+            return matches
+
+        expr = getRegEx(pattern)
+        candidates = []
+        parts = None
+
+        if pattern.startswith('/') and not OSCregexchars.search(pattern):
+            parts = _splitPattern(pattern)
+
+        if parts is None:
+            candidates = self.callbacks.keys()
+        else:
+            self._collect(self._getTrie(), parts[1:], candidates)
+            if 'default' in self.callbacks:
+                candidates.append('default')
+
+        matches = []
+        for addr in candidates:
+            match = expr.match(addr)
+            if match and (match.end() == len(addr)):
+                matches.append(addr)
+
+        self._matches[pattern] = matches
+        return matches
+
+    def _collect(self, node, parts, out):
+        """Adds the addresses in the trie 'node' the remaining pattern 'parts' may match to 'out'.
+        """
+        if not parts:
+            if None in node:
+                out.append(node[None])
+            return
+
+        part = parts[0]
+
+        if not OSCwildcards.search(part):
+            if part in node:
+                self._collect(node[part], parts[1:], out)
+            return
+
+        # '*' and '?' may match across '/', and so may a '[^..]' group
+        if '*' in part or '?' in part or '[^' in part:
+            self._collectAll(node, out)
+            return
+
+        try:
+            expr = getRegEx(part + r"\Z")  # anchored, so '{a,ab}' finds 'ab' too
+        except re.error:
+            self._collectAll(node, out)
+            return
+
+        for name, child in node.items():
+            if name is not None and expr.match(name):
+                self._collect(child, parts[1:], out)
+
+    def _collectAll(self, node, out):
+        for name, child in node.items():
+            if name is None:
+                out.append(child)
+            else:
+                self._collectAll(child, out)
 
     def getOSCAddressSpace(self):
         """Returns a list containing all OSC-addresses registerd with this Server. 
@@ -1760,20 +2245,23 @@ class OSCAddressSpace:
             raise OSCServerError(
                 "Malformed OSC-message; got %d typetags [%s] vs. %d values" % (len(tags), tags, len(data)))
 
-        expr = getRegEx(pattern)
+        if OSCpatternchars.search(pattern):
+            addresses = self._matchPattern(pattern)
+        elif pattern in self.callbacks:
+            addresses = (pattern,)
+        else:
+            addresses = ()
 
         replies = []
         matched = 0
-        for addr in self.callbacks.keys():
-            match = expr.match(addr)
-            if match and (match.end() == len(addr)):
-                reply = self.callbacks[addr](pattern, tags, data, client_address)
-                matched += 1
-                if isinstance(reply, OSCMessage):
-                    replies.append(reply)
-                elif reply != None:
-                    raise TypeError("Message-callback %s did not return OSCMessage or None: %s" % (
-                        self.server.callbacks[addr], type(reply)))
+        for addr in addresses:
+            reply = self.callbacks[addr](pattern, tags, data, client_address)
+            matched += 1
+            if isinstance(reply, OSCMessage):
+                replies.append(reply)
+            elif reply != None:
+                raise TypeError("Message-callback %s did not return OSCMessage or None: %s" % (
+                    self.server.callbacks[addr], type(reply)))
 
         if matched == 0:
             if 'default' in self.callbacks:
@@ -1823,7 +2311,7 @@ class OSCRequestHandler(DatagramRequestHandler):
     def handle(self):
         """Handle incoming OSCMessage
         """
-        decoded = decodeOSC(self.packet)
+        decoded = self.server.decode(self.packet)
         if not len(decoded):
             return
 
@@ -2585,7 +3073,7 @@ class OSCStreamRequestHandler(StreamRequestHandler, OSCAddressSpace):
             print "SERVER: Socket has been closed."
             return None
         # decode OSC data and dispatch
-        msg = decodeOSC(chunk)
+        msg = self.decode(chunk)
         if msg == None:
             raise OSCError("SERVER: Message decoding failed.")
         return msg
@@ -2810,7 +3298,7 @@ class OSCStreamingClient(OSCAddressSpace):
         if not chunk:
             return None
         # decode OSC content
-        msg = decodeOSC(chunk)
+        msg = self.decode(chunk)
         if msg == None:
             raise OSCError("CLIENT: Message decoding failed.")
         return msg
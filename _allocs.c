@@ -0,0 +1,41 @@
+/* Object allocation counter for bench.py (Python 2, Linux).
+ *
+ * Preloaded with LD_PRELOAD, this takes the place of libpython's PyObject_Malloc and
+ * PyObject_Realloc and counts the calls allocating a new block, in 'pyobject_allocs',
+ * before handing them on. bench.py reads the counter through ctypes to report allocations
+ * per record. Objects reusing a free list (small ints, floats, short tuples) never reach
+ * PyObject_Malloc and are not counted.
+ *
+ * Build with ./build-parse.sh. Only works against a shared libpython, whose own calls go
+ * through the PLT; bench.py notices when the counter does not move.
+ */
+#define _GNU_SOURCE
+#include <dlfcn.h>
+#include <stddef.h>
+
+unsigned long pyobject_allocs = 0;
+
+static void *(*real_malloc)(size_t);
+static void *(*real_realloc)(void *, size_t);
+
+void *
+PyObject_Malloc(size_t size)
+{
+    if (real_malloc == NULL)
+        real_malloc = (void *(*)(size_t))dlsym(RTLD_NEXT, "PyObject_Malloc");
+
+    pyobject_allocs++;
+    return real_malloc(size);
+}
+
+void *
+PyObject_Realloc(void *p, size_t size)
+{
+    if (real_realloc == NULL)
+        real_realloc = (void *(*)(void *, size_t))dlsym(RTLD_NEXT, "PyObject_Realloc");
+
+    if (p == NULL)
+        pyobject_allocs++;
+
+    return real_realloc(p, size);
+}
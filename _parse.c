@@ -0,0 +1,628 @@
+/* Compiled CDP, DCC and LCM decoders for parse.py (Python 2).
+ *
+ * Build in place with ./build-parse.sh; parse.py picks the module up when it imports.
+ *
+ * Each decoder validates the whole datagram before calling any handler. Well-formed
+ * datagrams are decoded here; anything else goes to the Python decoder registered with
+ * set_fallbacks(), so malformed input is reported exactly as parse.py reports it and a
+ * handler never sees part of a datagram twice.
+ */
+#include <Python.h>
+#include <structmember.h>
+#include <string.h>
+#include <stdint.h>
+
+#define CDP_MAGIC 0x3230434CU
+#define CDP_T_USER 0x0007
+#define CDP_T_POS 0x0100
+#define CDP_HEADER_SIZE 20
+#define CDP_POSITION_SIZE 24
+#define CDP_GESTURE_SIZE 14
+
+#define DCC_HEADER_SIZE 14
+#define DCC_CRC_SIZE 2
+#define DCC_ENTRY_SIZE 17
+#define MSG_UWB_EVT_TAG_LOC_CHANGED 0x88
+#define MSG_UWB_EVT_ANCHOR_LOC_CHANGED 0x89
+
+#define LCM_MAGIC 0x4C433032U
+#define CIH_MAGIC 0xC1401A51U
+#define LCM_HEADER_SIZE 8
+#define LCM_P3_SIZE 35
+
+static const char CDP_VERSN[8] = "CDP0002";
+
+static PyObject *fallback_cdp = NULL;
+static PyObject *fallback_cdp_records = NULL;
+static PyObject *position_record = NULL;
+static PyObject *gesture_record = NULL;
+
+/* __slots__ of parse.PositionRecord and parse.GestureRecord, filled in this order */
+static const char *position_fields[] = {"serial", "position", "quality", "smoothing", "sequence", "network_time", NULL};
+static const char *gesture_fields[] = {"serial", "sequence", "mask", "w_ang", "v_ang", "h_ang", "tap_d", "tap_v",
+                                       "omni_d", "omni_v", "shake_d", "shake_v", "shake_du", "lasso_d", "lasso_v", NULL};
+static Py_ssize_t position_offsets[6];
+static Py_ssize_t gesture_offsets[15];
+static PyObject *fallback_dcc = NULL;
+static PyObject *fallback_lcm = NULL;
+static PyObject *lcm_channels = NULL;
+static PyObject *lcm_p3 = NULL;
+
+static uint16_t dcc_crc_table[256];
+
+
+static uint16_t
+u16le(const unsigned char *p)
+{
+    return (uint16_t)(p[0] | (p[1] << 8));
+}
+
+static uint32_t
+u32le(const unsigned char *p)
+{
+    return (uint32_t)p[0] | ((uint32_t)p[1] << 8) | ((uint32_t)p[2] << 16) | ((uint32_t)p[3] << 24);
+}
+
+static uint16_t
+u16be(const unsigned char *p)
+{
+    return (uint16_t)((p[0] << 8) | p[1]);
+}
+
+static uint32_t
+u32be(const unsigned char *p)
+{
+    return ((uint32_t)p[0] << 24) | ((uint32_t)p[1] << 16) | ((uint32_t)p[2] << 8) | (uint32_t)p[3];
+}
+
+static double
+f32le(const unsigned char *p)
+{
+    uint32_t bits = u32le(p);
+    float value;
+    memcpy(&value, &bits, sizeof(value));
+    return value;
+}
+
+static double
+f32be(const unsigned char *p)
+{
+    uint32_t bits = u32be(p);
+    float value;
+    memcpy(&value, &bits, sizeof(value));
+    return value;
+}
+
+
+static PyObject *
+fallback(PyObject *func, PyObject *args, PyObject *kwargs)
+{
+    if (func == NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "_parse: set_fallbacks() was not called");
+        return NULL;
+    }
+
+    return PyObject_Call(func, args, kwargs);
+}
+
+
+/* CDP */
+
+static int
+cdp_valid(const unsigned char *p, Py_ssize_t len)
+{
+    Py_ssize_t offset = CDP_HEADER_SIZE;
+
+    if (len < CDP_HEADER_SIZE || u32le(p) != CDP_MAGIC || memcmp(p + 8, CDP_VERSN, 8))
+        return 0;
+
+    while (len - offset >= 4) {
+        unsigned typ = u16le(p + offset);
+        unsigned size = u16le(p + offset + 2);
+        offset += 4;
+
+        if (offset + size > len)
+            return 0;
+
+        if (typ == CDP_T_USER && offset >= len)
+            return 0;
+
+        if (typ == CDP_T_POS && size != CDP_POSITION_SIZE)
+            return 0;
+
+        offset += size;
+    }
+
+    return 1;
+}
+
+/* A new instance of 'type' with its slots at 'offsets' set to 'values' (references stolen),
+ * skipping the Python-level __init__. */
+static PyObject *
+new_record(PyObject *type, const Py_ssize_t *offsets, PyObject **values, int count)
+{
+    PyObject *record = NULL;
+    int i;
+
+    for (i = 0; i < count; i++)
+        if (values[i] == NULL)
+            goto done;
+
+    record = ((PyTypeObject *)type)->tp_alloc((PyTypeObject *)type, 0);
+
+    if (record == NULL)
+        goto done;
+
+    for (i = 0; i < count; i++) {
+        *(PyObject **)((char *)record + offsets[i]) = values[i];
+        values[i] = NULL;
+    }
+
+done:
+    for (i = 0; i < count; i++)
+        Py_XDECREF(values[i]);
+
+    return record;
+}
+
+static PyObject *
+cdp_position_record(PyObject *uid, const unsigned char *p)
+{
+    PyObject *values[6];
+
+    Py_INCREF(uid);
+    values[0] = uid;
+    values[1] = Py_BuildValue("(ddd)",
+                              (int32_t)u32le(p) / 1000.0,
+                              (int32_t)u32le(p + 4) / 1000.0,
+                              (int32_t)u32le(p + 8) / 1000.0);
+    values[2] = PyInt_FromSize_t(u32le(p + 12));
+    values[3] = PyInt_FromLong(u16le(p + 16));
+    values[4] = PyInt_FromLong(u16le(p + 18));
+    values[5] = PyInt_FromSize_t(u32le(p + 20));
+    return new_record(position_record, position_offsets, values, 6);
+}
+
+static PyObject *
+cdp_gesture_record(PyObject *uid, const unsigned char *p)
+{
+    PyObject *values[15];
+    int i;
+
+    Py_INCREF(uid);
+    values[0] = uid;
+    values[1] = PyInt_FromLong(p[0]);
+    values[2] = PyInt_FromLong(p[1]);
+
+    for (i = 2; i < CDP_GESTURE_SIZE; i++)
+        values[i + 1] = PyInt_FromLong((signed char)p[i]);
+
+    return new_record(gesture_record, gesture_offsets, values, 15);
+}
+
+/* parse_cdp() and, with 'records' set, parse_cdp_records() */
+static PyObject *
+cdp_decode(PyObject *args, PyObject *kwargs, int records)
+{
+    static char *kwlist[] = {"data", "handler", NULL};
+    PyObject *data, *handler, *uid = NULL, *results = NULL, *view = NULL;
+    PyObject *fallback_func = records ? fallback_cdp_records : fallback_cdp;
+    const unsigned char *p;
+    Py_ssize_t len, offset;
+    Py_buffer buf;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, records ? "OO:parse_cdp_records" : "OO:parse_cdp",
+                                     kwlist, &data, &handler))
+        return NULL;
+
+    if (records && (position_record == NULL || gesture_record == NULL)) {
+        PyErr_SetString(PyExc_RuntimeError, "_parse: set_records() was not called");
+        return NULL;
+    }
+
+    if (PyObject_GetBuffer(data, &buf, PyBUF_SIMPLE) < 0) {
+        PyErr_Clear();
+        return fallback(fallback_func, args, kwargs);
+    }
+
+    p = buf.buf;
+    len = buf.len;
+
+    if (!cdp_valid(p, len)) {
+        PyBuffer_Release(&buf);
+        return fallback(fallback_func, args, kwargs);
+    }
+
+    uid = PyInt_FromSize_t(u32le(p + 16));
+    results = PyList_New(0);
+
+    if (uid == NULL || results == NULL)
+        goto error;
+
+    for (offset = CDP_HEADER_SIZE; len - offset >= 4;) {
+        unsigned typ = u16le(p + offset);
+        unsigned size = u16le(p + offset + 2);
+        PyObject *result = NULL;
+        offset += 4;
+
+        if (typ == CDP_T_USER && records) {
+            if (p[offset] == 0x04 && size > CDP_GESTURE_SIZE) {
+                PyObject *record = cdp_gesture_record(uid, p + offset + 1);
+
+                if (record == NULL)
+                    goto error;
+
+                result = PyObject_CallFunctionObjArgs(handler, record, NULL);
+                Py_DECREF(record);
+
+                if (result == NULL)
+                    goto error;
+            }
+        }
+        else if (typ == CDP_T_USER) {
+            if (p[offset] == 0x04) {
+                PyObject *user_data;
+
+                if (view == NULL && (view = PyMemoryView_FromObject(data)) == NULL)
+                    goto error;
+
+                if ((user_data = PySequence_GetSlice(view, offset, len)) == NULL)
+                    goto error;
+
+                result = PyObject_CallFunctionObjArgs(handler, uid, Py_None, user_data, NULL);
+                Py_DECREF(user_data);
+
+                if (result == NULL)
+                    goto error;
+            }
+        }
+        else if (typ == CDP_T_POS && records) {
+            PyObject *record = cdp_position_record(uid, p + offset);
+
+            if (record == NULL)
+                goto error;
+
+            result = PyObject_CallFunctionObjArgs(handler, record, NULL);
+            Py_DECREF(record);
+
+            if (result == NULL)
+                goto error;
+        }
+        else if (typ == CDP_T_POS) {
+            PyObject *position = Py_BuildValue("(ddd)",
+                                               (int32_t)u32le(p + offset) / 1000.0,
+                                               (int32_t)u32le(p + offset + 4) / 1000.0,
+                                               (int32_t)u32le(p + offset + 8) / 1000.0);
+
+            if (position == NULL)
+                goto error;
+
+            result = PyObject_CallFunctionObjArgs(handler, uid, position, Py_None, NULL);
+            Py_DECREF(position);
+
+            if (result == NULL)
+                goto error;
+        }
+
+        if (result != NULL) {
+            int truth = PyObject_IsTrue(result);
+            PyObject *extended = NULL;
+
+            if (truth > 0)
+                extended = _PyList_Extend((PyListObject *)results, result);
+
+            Py_DECREF(result);
+
+            if (truth < 0 || (truth > 0 && extended == NULL))
+                goto error;
+
+            Py_XDECREF(extended);
+        }
+
+        offset += size;
+    }
+
+    Py_XDECREF(view);
+    Py_DECREF(uid);
+    PyBuffer_Release(&buf);
+    return results;
+
+error:
+    Py_XDECREF(view);
+    Py_XDECREF(uid);
+    Py_XDECREF(results);
+    PyBuffer_Release(&buf);
+    return NULL;
+}
+
+static PyObject *
+parse_cdp(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    return cdp_decode(args, kwargs, 0);
+}
+
+static PyObject *
+parse_cdp_records(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    return cdp_decode(args, kwargs, 1);
+}
+
+
+/* DCC */
+
+static uint16_t
+dcc_crc(const unsigned char *p, Py_ssize_t len)
+{
+    uint16_t crc = 0xFFFF;
+    Py_ssize_t i;
+
+    for (i = 0; i < len; i++)
+        crc = (uint16_t)((crc << 8) ^ dcc_crc_table[(crc >> 8) ^ p[i]]);
+
+    return crc;
+}
+
+static PyObject *
+parse_dcc(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    static char *kwlist[] = {"data", "handler", "check_crc", NULL};
+    PyObject *data, *handler, *check_crc = Py_False, *results;
+    const unsigned char *p;
+    Py_ssize_t len, count, i;
+    unsigned msg_type;
+    Py_buffer buf;
+    int crc;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "OO|O:parse_dcc", kwlist, &data, &handler, &check_crc))
+        return NULL;
+
+    if ((crc = PyObject_IsTrue(check_crc)) < 0)
+        return NULL;
+
+    if (PyObject_GetBuffer(data, &buf, PyBUF_SIMPLE) < 0) {
+        PyErr_Clear();
+        return fallback(fallback_dcc, args, kwargs);
+    }
+
+    p = buf.buf;
+    len = buf.len;
+
+    if (len < DCC_HEADER_SIZE + DCC_CRC_SIZE ||
+        u32le(p + 10) != (uint32_t)(len - DCC_HEADER_SIZE - DCC_CRC_SIZE) ||
+        (crc && u16le(p + len - DCC_CRC_SIZE) != dcc_crc(p, len - DCC_CRC_SIZE)) ||
+        (len > DCC_HEADER_SIZE + DCC_CRC_SIZE &&
+         DCC_HEADER_SIZE + 1 + p[DCC_HEADER_SIZE] * DCC_ENTRY_SIZE > len - DCC_CRC_SIZE)) {
+        PyBuffer_Release(&buf);
+        return fallback(fallback_dcc, args, kwargs);
+    }
+
+    msg_type = p[3];
+
+    if (msg_type != MSG_UWB_EVT_TAG_LOC_CHANGED) {
+        PyBuffer_Release(&buf);
+        Py_RETURN_NONE;
+    }
+
+    count = len > DCC_HEADER_SIZE + DCC_CRC_SIZE ? p[DCC_HEADER_SIZE] : 0;
+
+    if ((results = PyList_New(0)) == NULL)
+        goto error;
+
+    for (i = 0; i < count; i++) {
+        const unsigned char *entry = p + DCC_HEADER_SIZE + 1 + i * DCC_ENTRY_SIZE;
+        PyObject *result = PyObject_CallFunction(handler, "dl(ddd)",
+                                                 u32le(entry) / 1000.0,
+                                                 (long)(0x00020000 | (entry[4] + 128)),
+                                                 f32le(entry + 5), f32le(entry + 9), f32le(entry + 13));
+
+        if (result == NULL)
+            goto error;
+
+        if (result != Py_None) {
+            PyObject *extended = NULL;
+            int failed;
+
+            if (PyList_CheckExact(result) || PyTuple_CheckExact(result)) {
+                extended = _PyList_Extend((PyListObject *)results, result);
+                failed = extended == NULL;
+                Py_XDECREF(extended);
+            }
+            else {
+                failed = PyList_Append(results, result) < 0;
+            }
+
+            Py_DECREF(result);
+
+            if (failed)
+                goto error;
+        }
+        else {
+            Py_DECREF(result);
+        }
+    }
+
+    PyBuffer_Release(&buf);
+    return results;
+
+error:
+    Py_XDECREF(results);
+    PyBuffer_Release(&buf);
+    return NULL;
+}
+
+
+/* LCM */
+
+static PyObject *
+parse_lcm(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    static char *kwlist[] = {"data", "handler", NULL};
+    PyObject *data, *handler, *user_data, *result;
+    const unsigned char *p, *nul, *m;
+    Py_ssize_t len, offset, start, user_size;
+    Py_buffer buf;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "OO:parse_lcm", kwlist, &data, &handler))
+        return NULL;
+
+    if (PyObject_GetBuffer(data, &buf, PyBUF_SIMPLE) < 0) {
+        PyErr_Clear();
+        return fallback(fallback_lcm, args, kwargs);
+    }
+
+    p = buf.buf;
+    len = buf.len;
+
+    /* only well-formed P3 messages are decoded here, and only while parse.lcm_p3 is the
+     * decoder registered for P3; every other channel goes through LCM_CHANNELS */
+    if (len < LCM_HEADER_SIZE + 3 || u32be(p) != LCM_MAGIC ||
+        (nul = memchr(p + LCM_HEADER_SIZE, 0, len - LCM_HEADER_SIZE)) == NULL ||
+        nul - p != LCM_HEADER_SIZE + 2 || p[LCM_HEADER_SIZE] != 'P' || p[LCM_HEADER_SIZE + 1] != '3' ||
+        lcm_channels == NULL || PyDict_GetItemString(lcm_channels, "P3") != lcm_p3) {
+        PyBuffer_Release(&buf);
+        return fallback(fallback_lcm, args, kwargs);
+    }
+
+    offset = nul - p + 1;
+    m = p + offset + 4;
+    start = offset + 4 + LCM_P3_SIZE;
+    user_size = len - start - 4;
+
+    if (len < start || u32be(p + offset) != CIH_MAGIC || user_size < 0 || user_size != u16be(m + 33)) {
+        PyBuffer_Release(&buf);
+        return fallback(fallback_lcm, args, kwargs);
+    }
+
+    user_data = PyString_FromStringAndSize((const char *)p + start, user_size >= 4 ? user_size - 4 : 0);
+
+    if (user_data == NULL) {
+        PyBuffer_Release(&buf);
+        return NULL;
+    }
+
+    result = PyObject_CallFunction(handler, "N(ddd)O", PyInt_FromSize_t(u32be(m + 2)),
+                                   f32be(m + 8), f32be(m + 12), f32be(m + 16), user_data);
+    Py_DECREF(user_data);
+    PyBuffer_Release(&buf);
+    return result;
+}
+
+
+static PyObject *
+set_fallbacks(PyObject *self, PyObject *args)
+{
+    PyObject *cdp, *dcc, *lcm, *channels, *p3;
+
+    if (!PyArg_ParseTuple(args, "OOOO!O:set_fallbacks", &cdp, &dcc, &lcm, &PyDict_Type, &channels, &p3))
+        return NULL;
+
+    Py_INCREF(cdp);
+    Py_INCREF(dcc);
+    Py_INCREF(lcm);
+    Py_INCREF(channels);
+    Py_INCREF(p3);
+    Py_XDECREF(fallback_cdp);
+    Py_XDECREF(fallback_dcc);
+    Py_XDECREF(fallback_lcm);
+    Py_XDECREF(lcm_channels);
+    Py_XDECREF(lcm_p3);
+    fallback_cdp = cdp;
+    fallback_dcc = dcc;
+    fallback_lcm = lcm;
+    lcm_channels = channels;
+    lcm_p3 = p3;
+    Py_RETURN_NONE;
+}
+
+
+/* Find the storage offset of each named slot of 'type'. */
+static int
+slot_offsets(PyObject *type, const char **names, Py_ssize_t *offsets)
+{
+    int i;
+
+    if (!PyType_Check(type)) {
+        PyErr_SetString(PyExc_TypeError, "set_records: record types must be classes");
+        return -1;
+    }
+
+    for (i = 0; names[i] != NULL; i++) {
+        PyObject *descr = PyDict_GetItemString(((PyTypeObject *)type)->tp_dict, names[i]);
+        PyMemberDef *member;
+
+        if (descr == NULL || Py_TYPE(descr) != &PyMemberDescr_Type) {
+            PyErr_Format(PyExc_TypeError, "set_records: %.100s has no slot '%s'",
+                         ((PyTypeObject *)type)->tp_name, names[i]);
+            return -1;
+        }
+
+        member = ((PyMemberDescrObject *)descr)->d_member;
+
+        if (member->type != T_OBJECT_EX) {
+            PyErr_Format(PyExc_TypeError, "set_records: %.100s.%s is not a slot",
+                         ((PyTypeObject *)type)->tp_name, names[i]);
+            return -1;
+        }
+
+        offsets[i] = member->offset;
+    }
+
+    return 0;
+}
+
+static PyObject *
+set_records(PyObject *self, PyObject *args)
+{
+    PyObject *cdp, *position, *gesture;
+
+    if (!PyArg_ParseTuple(args, "OOO:set_records", &cdp, &position, &gesture))
+        return NULL;
+
+    if (slot_offsets(position, position_fields, position_offsets) < 0 ||
+        slot_offsets(gesture, gesture_fields, gesture_offsets) < 0)
+        return NULL;
+
+    Py_INCREF(cdp);
+    Py_INCREF(position);
+    Py_INCREF(gesture);
+    Py_XDECREF(fallback_cdp_records);
+    Py_XDECREF(position_record);
+    Py_XDECREF(gesture_record);
+    fallback_cdp_records = cdp;
+    position_record = position;
+    gesture_record = gesture;
+    Py_RETURN_NONE;
+}
+
+
+static PyMethodDef methods[] = {
+    {"parse_cdp", (PyCFunction)parse_cdp, METH_VARARGS | METH_KEYWORDS, "parse_cdp(data, handler)"},
+    {"parse_cdp_records", (PyCFunction)parse_cdp_records, METH_VARARGS | METH_KEYWORDS,
+     "parse_cdp_records(data, handler)"},
+    {"parse_dcc", (PyCFunction)parse_dcc, METH_VARARGS | METH_KEYWORDS, "parse_dcc(data, handler, check_crc=False)"},
+    {"parse_lcm", (PyCFunction)parse_lcm, METH_VARARGS | METH_KEYWORDS, "parse_lcm(data, handler)"},
+    {"set_fallbacks", set_fallbacks, METH_VARARGS,
+     "set_fallbacks(parse_cdp, parse_dcc, parse_lcm, lcm_channels, lcm_p3)\n\n"
+     "Register the Python decoders malformed datagrams are handed to."},
+    {"set_records", set_records, METH_VARARGS,
+     "set_records(parse_cdp_records, PositionRecord, GestureRecord)\n\n"
+     "Register the Python records decoder and the record types parse_cdp_records() creates."},
+    {NULL, NULL, 0, NULL}
+};
+
+PyMODINIT_FUNC
+init_parse(void)
+{
+    unsigned i, bit;
+
+    for (i = 0; i < 256; i++) {
+        uint16_t crc = (uint16_t)(i << 8);
+
+        for (bit = 0; bit < 8; bit++)
+            crc = (uint16_t)(crc & 0x8000 ? (crc << 1) ^ 0x1021 : crc << 1);
+
+        dcc_crc_table[i] = crc;
+    }
+
+    Py_InitModule3("_parse", methods, "Compiled decoders for parse.py; see parse.py for the contract.");
+}
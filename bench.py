@@ -0,0 +1,583 @@
+#!/usr/bin/env python2
+"""Parser benchmarks, conformance checks and fuzzing on synthetic datagrams.
+
+Allocations per record are counted by _allocs.so (see build-parse.sh), which bench.py
+preloads by running itself again when it is built.
+"""
+from __future__ import print_function
+import os
+import sys
+import ctypes
+import signal
+import struct
+import random
+import argparse
+import timeit
+import traceback
+import StringIO
+
+import parse
+import protocol
+import sequence
+
+ALLOCS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_allocs.so")
+
+
+class Hang(Exception):
+    pass
+
+
+def cdp_frame(serial, users, sequence=0):
+    """A CDP datagram for one tag: 'users' gesture records followed by a position record.
+    """
+    user = struct.pack("<HH", parse.CDP_T_USER, 16) + struct.pack("<BBB13x", 0x04, sequence & 0xFF, 0x0F)
+    position = struct.pack("<HH", parse.CDP_T_POS, 24) + struct.pack("<iiiIHHI", 1234, -5678, 910, 80, 2, sequence, 0)
+    return struct.pack("<II8sI", parse.CDP_MAGIC, sequence, parse.CDP_VERSN, serial) + user * users + position
+
+
+def dcc_frame(entries, sequence=0, msg_type=parse.MSG_UWB_EVT_TAG_LOC_CHANGED):
+    """A DCC location datagram with 'entries' location entries and a valid CRC.
+    """
+    payload = chr(entries) + "".join(
+        struct.pack("<IBfff", sequence * 100 + i, i, i * 0.5, -i * 0.25, 1.5) for i in range(entries)
+    )
+    data = parse.DCC_HEADER.pack("\xAA\x55\xAA", msg_type, 1, 2, sequence & 0xFFFF, len(payload)) + payload
+    return data + parse.DCC_CRC.pack(parse.dcc_crc(data))
+
+
+def lcm_frame(serial, user_data="", sequence=0, channel="P3"):
+    """An LCM datagram carrying a Ciholas P3 position for one tag.
+    """
+    p3 = parse.LCM_P3.pack(len(user_data) + 36, serial, 1, 1.25, -2.5, 0.75, 80, 2, sequence, len(user_data))
+    return (parse.LCM_HEADER.pack(parse.LCM_MAGIC, sequence) + channel + "\0" +
+            parse.CIH_HEADER.pack(parse.CIH_MAGIC) + p3 + user_data + struct.pack(">I", parse.LCM_FOOTR))
+
+
+def mutate(data, rng):
+    """A damaged copy of 'data': truncated, extended, or with a few bytes overwritten.
+    """
+    choice = rng.randrange(4)
+
+    if choice == 0:
+        return data[:rng.randrange(len(data) + 1)]
+
+    if choice == 1:
+        return data + "".join(chr(rng.randrange(256)) for _ in range(rng.randrange(1, 32)))
+
+    data = bytearray(data)
+
+    for _ in range(rng.randrange(1, 4)):
+        data[rng.randrange(len(data))] = rng.randrange(256) if choice == 2 else rng.choice((0, 0xFF, 0x7F))
+
+    return str(data)
+
+
+def legacy_parse_cdp(data, handler):
+    """The slicing decoder parse.parse_cdp replaced, kept as the baseline.
+    """
+    if len(data) < 20:
+        return
+
+    mark, seq, version, uid = struct.unpack("<II8sI", data[:20])
+
+    if mark != parse.CDP_MAGIC or version != parse.CDP_VERSN:
+        return
+
+    data = data[20:]
+    results = []
+
+    while len(data) >= 4:
+        typ, size = struct.unpack("<HH", data[:4])
+        data = data[4:]
+
+        if len(data) < size:
+            return
+
+        if typ == parse.CDP_T_USER:
+            if ord(data[0]) == 0x04:
+                result = handler(uid, None, data)
+
+                if result:
+                    results.extend(result)
+
+        elif typ == parse.CDP_T_POS:
+            if len(data) != 24:
+                return
+
+            px, py, pz, quality, smoothing, sequence, network_time = struct.unpack("<iiiIHHI", data)
+            result = handler(uid, (px / 1000.0, py / 1000.0, pz / 1000.0), None)
+
+            if result:
+                results.extend(result)
+
+        data = data[size:]
+
+    return results
+
+
+def mix(name, args, rng, count=256):
+    """'count' datagrams of protocol 'name' for args.tags tags in turn: args.user_ratio of
+    them carry user data (CDP gestures, LCM user bytes), args.malformed of them are damaged.
+    A DCC datagram reports all tags at once (at most 255).
+    """
+    frames = []
+
+    for i in range(count):
+        serial = 0x06021300 + i % args.tags
+        sequence = i // args.tags
+        user = rng.random() < args.user_ratio
+
+        if name == "cdp":
+            data = cdp_frame(serial, rng.randint(1, 4) if user else 0, sequence)
+        elif name == "dcc":
+            data = dcc_frame(min(args.tags, 255), i)
+        else:
+            data = lcm_frame(serial, "u" * rng.randint(1, 32) if user else "", sequence)
+
+        if rng.random() < args.malformed:
+            data = mutate(data, rng)
+
+        frames.append(data)
+
+    return frames
+
+
+def null_handler(serial, position, user_data):
+    pass
+
+
+def null_record_handler(record):
+    pass
+
+
+def null_any_handler(*args):
+    pass
+
+
+def measure(parser, frames, seconds, handler=null_handler, **kwargs):
+    """Returns the frames per second 'parser' sustains over the list of frames.
+    """
+    count = 0
+    start = timeit.default_timer()
+    elapsed = 0.0
+
+    while elapsed < seconds:
+        for frame in frames:
+            parser(frame, handler, **kwargs)
+
+        count += len(frames)
+        elapsed = timeit.default_timer() - start
+
+    return count / elapsed
+
+
+def bench_cdp(args):
+    print("{:>8} {:>14} {:>14} {:>8}".format("records", "legacy rec/s", "parse rec/s", "gain"))
+
+    for users in args.records:
+        frames = [cdp_frame(0x06021300 + i, users, i) for i in range(64)]
+        legacy = measure(legacy_parse_cdp, frames, args.time) * (users + 1)
+        current = measure(parse.parse_cdp, frames, args.time) * (users + 1)
+        print("{:>8} {:>14.0f} {:>14.0f} {:>7.2f}x".format(users + 1, legacy, current, current / legacy))
+
+
+def bench_cdp_batch(args):
+    if parse.numpy is None:
+        print("numpy not available, skipping batch decoding", file=sys.stderr)
+        return
+
+    frames = [cdp_frame(0x06021300 + i % 32, 0, i) for i in range(args.batch)]
+    start = timeit.default_timer()
+    count = 0
+
+    while timeit.default_timer() - start < args.time:
+        parse.cdp_positions(frames)
+        count += len(frames)
+
+    batch = count / (timeit.default_timer() - start)
+    single = measure(parse.parse_cdp, frames, args.time)
+    print("{:>8} {:>14.0f} {:>14.0f} {:>7.2f}x  (batch of {}, cdp_positions vs parse_cdp)".format(
+        1, single, batch, batch / single, args.batch))
+
+
+def alloc_counter():
+    """The allocation counter of a preloaded _allocs.so, or None.
+    """
+    try:
+        return ctypes.c_ulong.in_dll(ctypes.CDLL(None), "pyobject_allocs")
+    except ValueError:
+        return None
+
+
+def silenced(function, *args, **kwargs):
+    """Calls 'function' with the error logs writing to /dev/null.
+    """
+    stderr = sys.stderr
+
+    with open(os.devnull, "w") as sys.stderr:
+        try:
+            return function(*args, **kwargs)
+        finally:
+            sys.stderr = stderr
+            parse.ERRORS.reset()
+            protocol.ERRORS.reset()
+
+
+def count_records(parser, frames, **kwargs):
+    """Returns the number of handler calls 'parser' makes over 'frames', and the objects it
+    allocates for them (None without a working allocation counter).
+    """
+    counter = alloc_counter()
+    calls = [0]
+
+    def handler(*args):
+        calls[0] += 1
+
+    for frame in frames:  # warm up caches (struct formats, DCC entry structs)
+        parser(frame, null_any_handler, **kwargs)
+
+    before = counter.value if counter else 0
+
+    for frame in frames:
+        parser(frame, null_any_handler, **kwargs)
+
+    allocs = counter.value - before if counter else None
+
+    for frame in frames:
+        parser(frame, handler, **kwargs)
+
+    return calls[0], allocs
+
+
+def throughput(args):
+    """Records per second and allocations per record of each decoder, over datagram mixes
+    shaped by --tags, --user-ratio and --malformed.
+    """
+    rng = random.Random(args.seed)
+    frames = dict((name, mix(name, args, rng)) for name in ("cdp", "dcc", "lcm"))
+    frames["any"] = [frame for triple in zip(frames["cdp"], frames["dcc"], frames["lcm"]) for frame in triple]
+
+    decoders = [
+        ("cdp", "python", parse.python_parse_cdp, {}),
+        ("cdp/records", "python", parse.python_parse_cdp_records, {}),
+        ("cdp/records", "spec", parse.CDP_PROTOCOL.compiled, {}),
+        ("dcc", "python", parse.python_parse_dcc, {}),
+        ("dcc/crc", "python", parse.python_parse_dcc, {"check_crc": True}),
+        ("lcm", "python", parse.python_parse_lcm, {}),
+    ]
+
+    if parse._parse is not None:
+        decoders[1:1] = [("cdp", "C", parse.parse_cdp, {})]
+        decoders[3:3] = [("cdp/records", "C", parse.parse_cdp_records, {})]
+        decoders[6:6] = [("dcc", "C", parse.parse_dcc, {})]
+        decoders[8:8] = [("dcc/crc", "C", parse.parse_dcc, {"check_crc": True})]
+        decoders += [("lcm", "C", parse.parse_lcm, {})]
+
+    decoders.append(("any", "detect", protocol.parse, {}))
+
+    print("{} tags, {:.0%} user data, {:.0%} malformed".format(args.tags, args.user_ratio, args.malformed))
+    print("{:>12} {:>7} {:>14} {:>14} {:>13}".format("decoder", "", "datagrams/s", "records/s", "allocs/record"))
+
+    for name, implementation, decoder, kwargs in decoders:
+        sample = frames[name.split("/")[0]]
+        records, allocs = silenced(count_records, decoder, sample, **kwargs)
+        rate = silenced(measure, decoder, sample, args.time, null_any_handler, **kwargs)
+        print("{:>12} {:>7} {:>14.0f} {:>14.0f} {:>13}".format(
+            name, implementation, rate, rate * records / len(sample),
+            "{:.2f}".format(float(allocs) / records) if allocs is not None and records else "-"
+        ))
+
+
+def fuzz_cdp(rng):
+    """A CDP header followed by records of random types, claimed sizes and contents.
+    """
+    data = parse.CDP_HEADER.pack(parse.CDP_MAGIC, rng.getrandbits(32), parse.CDP_VERSN, rng.getrandbits(32))
+
+    for _ in range(rng.randrange(6)):
+        typ = rng.choice((parse.CDP_T_USER, parse.CDP_T_POS, rng.getrandbits(16)))
+        size = rng.choice((0, 1, 14, 15, 16, 24, rng.getrandbits(16)))
+        body = size if rng.random() < 0.8 else rng.randrange(64)
+        data += parse.CDP_RECORD.pack(typ, size) + ("\x04" if rng.random() < 0.5 else "") + random_bytes(rng, body)
+
+    return data
+
+
+def fuzz_dcc(rng):
+    """A DCC datagram whose entry count, length field and CRC may disagree with its size.
+    """
+    payload = random_bytes(rng, rng.choice((0, 1, 18, 35, rng.randrange(300))))
+    length = len(payload) if rng.random() < 0.7 else rng.getrandbits(32)
+    data = parse.DCC_HEADER.pack("\xAA\x55\xAA", rng.choice((0x88, 0x89, rng.getrandbits(8))), 1, 2,
+                                 rng.getrandbits(16), length) + payload
+    return data + (parse.DCC_CRC.pack(parse.dcc_crc(data)) if rng.random() < 0.5 else random_bytes(rng, 2))
+
+
+def fuzz_lcm(rng):
+    """An LCM datagram with a random channel name and a P3 message of random sizes.
+    """
+    data = parse.LCM_HEADER.pack(parse.LCM_MAGIC, rng.getrandbits(32))
+    data += rng.choice(("P3", "", "X", random_bytes(rng, 8))) + ("\0" if rng.random() < 0.9 else "")
+    data += parse.CIH_HEADER.pack(parse.CIH_MAGIC if rng.random() < 0.9 else rng.getrandbits(32))
+    user = random_bytes(rng, rng.randrange(16))
+    data += parse.LCM_P3.pack(rng.getrandbits(16), rng.getrandbits(32), 1, 0.5, 0.5, 0.5, 1, 1,
+                              rng.getrandbits(32), len(user) if rng.random() < 0.7 else rng.getrandbits(16))[
+            :rng.choice((parse.LCM_P3.size, rng.randrange(parse.LCM_P3.size)))]
+    return data + user + random_bytes(rng, rng.choice((4, 4, rng.randrange(8))))
+
+
+def random_bytes(rng, count):
+    return "".join(chr(rng.getrandbits(8)) for _ in range(count))
+
+
+def fuzz_frame(rng):
+    """A random datagram: structured with random fields, a valid one damaged a few times,
+    or plain noise.
+    """
+    choice = rng.randrange(5)
+
+    if choice == 0:
+        return rng.choice((fuzz_cdp, fuzz_dcc, fuzz_lcm))(rng)
+
+    if choice == 1:
+        return random_bytes(rng, rng.randrange(96))
+
+    data = rng.choice((
+        lambda: cdp_frame(rng.getrandbits(32), rng.randrange(4), rng.getrandbits(16)),
+        lambda: dcc_frame(rng.randrange(8), rng.getrandbits(16), rng.choice((0x88, 0x89))),
+        lambda: lcm_frame(rng.getrandbits(32), random_bytes(rng, rng.randrange(12)), rng.getrandbits(16)),
+        lambda: fuzz_cdp(rng),
+    ))()
+
+    for _ in range(choice - 1):
+        data = mutate(data, rng) if data else data
+
+    return data
+
+
+def on_alarm(signum, frame):
+    raise Hang()
+
+
+def fuzz(args):
+    """Feeds every decoder random datagrams, checking none raises or runs past --hang
+    seconds. Returns the number of failures.
+    """
+    rng = random.Random(args.seed)
+    decoders = [
+        ("cdp", parse.python_parse_cdp, {}),
+        ("cdp/records", parse.python_parse_cdp_records, {}),
+        ("cdp/spec", parse.CDP_PROTOCOL.compiled, {}),
+        ("dcc", parse.python_parse_dcc, {}),
+        ("dcc/crc", parse.python_parse_dcc, {"check_crc": True}),
+        ("lcm", parse.python_parse_lcm, {}),
+        ("detect", protocol.parse, {}),
+    ]
+
+    if parse._parse is not None:
+        decoders += [
+            ("cdp (C)", parse.parse_cdp, {}),
+            ("cdp/records (C)", parse.parse_cdp_records, {}),
+            ("dcc (C)", parse.parse_dcc, {}),
+            ("dcc/crc (C)", parse.parse_dcc, {"check_crc": True}),
+            ("lcm (C)", parse.parse_lcm, {}),
+        ]
+
+    handler = signal.signal(signal.SIGALRM, on_alarm)
+    failures = 0
+
+    try:
+        for i in range(args.fuzz):
+            data = fuzz_frame(rng)
+
+            for sample in (data, memoryview(data)):
+                for name, decoder, kwargs in decoders:
+                    signal.setitimer(signal.ITIMER_REAL, args.hang)
+
+                    try:
+                        silenced(decoder, sample, null_any_handler, **kwargs)
+                    except Hang:
+                        failures += 1
+                        print("{}: hangs on {!r}".format(name, data), file=sys.stderr)
+                    except Exception as e:
+                        failures += 1
+                        print("{}: {} on {!r}".format(name, type(e).__name__, data), file=sys.stderr)
+                    finally:
+                        signal.setitimer(signal.ITIMER_REAL, 0)
+    finally:
+        signal.signal(signal.SIGALRM, handler)
+
+    print("{:>11} {:>8} datagrams fuzzed, {} decoders, {} failures".format("fuzz", args.fuzz, len(decoders), failures))
+    return failures
+
+
+def observe(arg):
+    if type(arg) is memoryview:
+        return arg.tobytes()
+
+    if type(arg) in (parse.PositionRecord, parse.GestureRecord):
+        return (type(arg).__name__,) + tuple((name, getattr(arg, name)) for name in arg.__slots__)
+
+    return arg
+
+
+def record(data, parser, **kwargs):
+    """Runs 'parser' over 'data', returning everything observable: handler calls, the return
+    value or exception type, and what was printed. Compare the repr() (NaNs decode too).
+    """
+    calls = []
+
+    def handler(*args):
+        calls.append(tuple(observe(arg) for arg in args))
+        return [len(calls)] if len(calls) % 2 else None
+
+    # start each run with fresh error logs, so both report their first errors in full
+    parse.ERRORS.reset()
+    protocol.ERRORS.reset()
+
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = output = StringIO.StringIO()
+
+    try:
+        result = parser(data, handler, **kwargs)
+    except Exception as e:
+        result = type(e)
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+    parse.ERRORS.reset()
+    protocol.ERRORS.reset()
+    return calls, result, output.getvalue()
+
+
+def check(args):
+    """Compares the compiled decoders against the pure-Python ones, and the decoder
+    protocol.py generates from the CDP description against the hand-written one, on valid
+    and damaged datagrams. Returns the number of datagrams they disagree on.
+    """
+    rng = random.Random(args.seed)
+    cdp = lambda i: cdp_frame(rng.getrandbits(32), rng.randrange(4), i)
+    dcc = lambda i: dcc_frame(rng.randrange(8), i, rng.choice((0x88, 0x88, 0x89)))
+    lcm = lambda i: lcm_frame(rng.getrandbits(32), "u" * rng.randrange(12), i, rng.choice(("P3", "P3", "X")))
+
+    # the generic decoder words its complaints differently, so only its handler calls are compared
+    decoders = [("cdp/spec", parse.python_parse_cdp_records, parse.CDP_PROTOCOL.compiled, {}, cdp, 1)]
+
+    if parse._parse is None:
+        print("_parse not built, skipping compiled decoders", file=sys.stderr)
+    else:
+        decoders += [
+            ("cdp", parse.python_parse_cdp, parse.parse_cdp, {}, cdp, None),
+            ("cdp/records", parse.python_parse_cdp_records, parse.parse_cdp_records, {}, cdp, None),
+            ("dcc", parse.python_parse_dcc, parse.parse_dcc, {}, dcc, None),
+            ("dcc/crc", parse.python_parse_dcc, parse.parse_dcc, {"check_crc": True},
+             lambda i: dcc_frame(rng.randrange(8), i), None),
+            ("lcm", parse.python_parse_lcm, parse.parse_lcm, {}, lcm, None),
+        ]
+
+    mismatches = 0
+
+    for name, expected, actual, kwargs, frame, part in decoders:
+        for i in range(args.check):
+            data = frame(i)
+
+            if i % 2:
+                data = mutate(data, rng)
+
+            for sample in (data, memoryview(data)) if name.startswith("cdp") else (data,):
+                if repr(record(sample, expected, **kwargs)[:part]) != repr(record(sample, actual, **kwargs)[:part]):
+                    mismatches += 1
+                    print("{}: mismatch on {!r}".format(name, data), file=sys.stderr)
+
+        print("{:>11} {:>8} datagrams checked".format(name, args.check))
+
+    for name, frame in (("cdp", cdp), ("dcc", dcc), ("lcm", lcm)):
+        for i in range(args.check):
+            detected = protocol.detect(frame(i))
+
+            if detected is None or detected.name != name:
+                mismatches += 1
+                print("detect: {} datagram taken for {}".format(name, detected), file=sys.stderr)
+
+        print("{:>11} {:>8} datagrams detected".format(name, args.check))
+
+    # duplicates interleaved with new numbers are dropped, while a source restarting its
+    # numbers (e.g. a tag power cycled) must not lose them as duplicates
+    scenarios = [
+        # restart from 0, then a gap and a reorder
+        [(seq, True) for seq in range(11)] + [(10, False)] + [(seq, True) for seq in range(11)] + [(13, True), (12, True)],
+        # repeats interleaved with new numbers
+        [(1, True), (2, True), (3, True), (4, True), (3, False), (4, False), (5, True), (2, False), (5, False), (6, True)],
+        # restart from 1: dropped until RESTART_RUN seen numbers have counted up
+        [(seq, True) for seq in range(21)] + [(1, False), (2, False)] + [(seq, True) for seq in range(3, 7)],
+    ]
+
+    for name, modulus in (("cdp_gesture", 1 << 8), ("cdp_position", 1 << 16)):
+        tracker = sequence.Tracker(name, modulus)
+
+        for key, expected in enumerate(scenarios):
+            for seq, new in expected:
+                if tracker.check(key, seq) != new:
+                    mismatches += 1
+                    print("{}: sequence {} {}".format(name, seq, "dropped" if new else "passed"), file=sys.stderr)
+
+        totals = tracker.totals()
+
+        if (totals["duplicates"], totals["resets"], totals["gaps"], totals["reorders"]) != (7, 2, 2, 1):
+            mismatches += 1
+            print("{}: counted {}".format(name, totals), file=sys.stderr)
+
+        print("{:>11} {:>8} sequence numbers tracked".format(name.split("_")[1], sum(map(len, scenarios))))
+
+    return mismatches
+
+
+def main(args):
+    if args.check or args.fuzz:
+        if args.check and check(args) or args.fuzz and fuzz(args):
+            sys.exit(1)
+        return
+
+    if alloc_counter() is None and os.path.exists(ALLOCS) and ALLOCS not in os.environ.get("LD_PRELOAD", ""):
+        # run again with the allocation counter in place
+        env = dict(os.environ, LD_PRELOAD=" ".join(filter(None, (os.environ.get("LD_PRELOAD"), ALLOCS))))
+        sys.stdout.flush()
+        os.execve(sys.executable, [sys.executable] + sys.argv, env)
+
+    bench_cdp(args)
+    bench_cdp_batch(args)
+    throughput(args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--records', metavar='COUNT', type=int, nargs='+', default=[0, 4, 16, 64, 256],
+                        help='gesture records per CDP frame (each frame also carries one position record)')
+    parser.add_argument('-b', '--batch', metavar='COUNT', type=int, default=1024, help='datagrams per cdp_positions() call')
+    parser.add_argument('-t', '--time', metavar='SECONDS', type=float, default=0.5, help='time per measurement')
+    parser.add_argument('-c', '--check', metavar='COUNT', type=int, default=0,
+                        help='instead of benchmarking, compare compiled and Python decoders on COUNT datagrams each')
+    parser.add_argument('-f', '--fuzz', metavar='COUNT', type=int, default=0,
+                        help='instead of benchmarking, feed COUNT random datagrams to every decoder')
+    parser.add_argument('--hang', metavar='SECONDS', type=float, default=1.0,
+                        help='time a decoder may take on one datagram with --fuzz')
+    parser.add_argument('-n', '--tags', metavar='COUNT', type=int, default=16, help='tags in the datagram mixes')
+    parser.add_argument('-u', '--user-ratio', metavar='RATIO', type=float, default=0.25,
+                        help='share of datagrams in the mixes carrying user data')
+    parser.add_argument('-m', '--malformed', metavar='RATIO', type=float, default=0.05,
+                        help='share of datagrams in the mixes damaged')
+    parser.add_argument('-s', '--seed', metavar='SEED', type=int, default=0, help='random seed for datagrams')
+
+    try:
+        main(parser.parse_args())
+
+    except KeyboardInterrupt:
+        pass
+
+    except SystemExit:
+        raise
+
+    except:
+        traceback.print_exc()
+        sys.exit(1)
+
+    sys.exit(0)
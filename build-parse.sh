@@ -0,0 +1,7 @@
+#!/bin/bash -e
+# Build the optional compiled decoders (_parse.so) next to parse.py, and the allocation
+# counter bench.py preloads (_allocs.so).
+PYTHON=${PYTHON:-python2}
+cd "$(dirname "$0")"
+gcc -O2 -Wall -shared -fPIC -I"$($PYTHON -c 'import sysconfig; print(sysconfig.get_paths()["include"])')" _parse.c -o _parse.so $*
+gcc -O2 -Wall -shared -fPIC _allocs.c -o _allocs.so -ldl $*
@@ -0,0 +1,2 @@
+#!/bin/bash -e
+./dancio.py -I 10.0.0.143 -i 239.255.76.68 -p 7668 -O 10.0.0.143 -o 239.255.0.80 -P 10080 --all -r /midi/=239.255.0.81:10081 -v $*
@@ -4,7 +4,6 @@
 from __future__ import print_function
 import os
 import sys
-import struct
 import argparse
 import time
 import random
@@ -135,24 +134,27 @@ note_last = {}
 
 cdp_pos = {}
 cdp_pos_raw = {}
-cdp_dedup = {}
 cdp_reject = {}
 
 log_files = {}
 
 
-def handle_position_cdp_music(serial, position, user_data):
+def handle_position_cdp_music(record):
+    serial = record.serial
+
     if serial not in DEVICE_FILTER_CDP:
         return
 
     name, origin = DEVICE_FILTER_CDP[serial]
 
     result = []
+    has_event = 0
+    event_note = 0
 
-    if position is not None:
-        position_raw = [(a * b) - c for a, b, c in zip(position, DIRECTION, origin)]
+    if type(record) is parse.PositionRecord:
+        position_raw = [(a * b) - c for a, b, c in zip(record.position, DIRECTION, origin)]
         position = position_raw
-        position = position_smooth(serial, position_raw)  # human_filter_update(serial, position_raw)
+        position = position_smooth(serial, position_raw, lowpass_music)  # human_filter_update(serial, position_raw)
 
         if "pianist" in name:
             pass
@@ -163,40 +165,22 @@ def handle_position_cdp_music(serial, position, user_data):
             cdp_pos_raw[serial] = position_raw
             cdp_pos[serial] = position
 
-    if (user_data is None) or (len(user_data) < 15):
         if params.log and (position is not None):
             log_position(serial, position_raw, position, False, 0)
 
-        if len(result):
-            return result
         return
 
-    typ = struct.unpack("<B", user_data[:1])[0]
-
-    user_data = user_data[1:]
-    has_event = 0
-    event_note = 0
-
-    if typ == 4:
-        sequence, mask, w_ang, v_ang, h_ang, tap_d, tap_v, omni_d, omni_v, shake_d, shake_v, shake_du, lasso_d, lasso_v = struct.unpack(
-            '<BBbbbbbbbbbbbb', user_data[:14])
-
-        if serial in cdp_dedup and cdp_dedup[serial] == sequence:
-            return
-        else:
-            cdp_dedup[serial] = sequence
-
-        if (mask & 2) and (serial in cdp_pos) and (cdp_pos[serial][1] <= 2) and ("pianist" in name):
-            has_event = 1
-            pos = cdp_pos[serial]
-            note = map_note_cdp(pos[0])
+    if (record.mask & parse.GESTURE_TAP) and (serial in cdp_pos) and (cdp_pos[serial][1] <= 2) and ("pianist" in name):
+        has_event = 1
+        pos = cdp_pos[serial]
+        note = map_note_cdp(pos[0])
 
-            if (note is not None) and (not note_last_block(serial)):
-                event_note = note
-                result.append(osc_midi_note_on(name, note))
+        if (note is not None) and (not note_last_block(serial)):
+            event_note = note
+            result.append(osc_midi_note_on(name, note))
 
-                if params.verbose:
-                    print("{:08X}: note: {}".format(serial, note))
+            if params.verbose:
+                print("{:08X}: note: {}".format(serial, note))
 
     if params.log and (serial in cdp_pos):
         log_position(serial, cdp_pos_raw[serial], cdp_pos[serial], has_event, event_note)
@@ -205,7 +189,9 @@ def handle_position_cdp_music(serial, position, user_data):
         return result
 
 
-def handle_position_cdp(serial, position, user_data):
+def handle_position_cdp(record):
+    serial = record.serial
+
     if serial not in DEVICE_FILTER_CDP:
         return
 
@@ -213,8 +199,8 @@ def handle_position_cdp(serial, position, user_data):
 
     result = []
 
-    if position is not None:
-        position = [a * b for a, b in zip(position, DIRECTION)]
+    if type(record) is parse.PositionRecord:
+        position = [a * b for a, b in zip(record.position, DIRECTION)]
         position = position_smooth(serial, position)
 
         if "pianist" in name:
@@ -231,35 +217,32 @@ def handle_position_cdp(serial, position, user_data):
         if "tramp" not in name:
             result.append(osc_position(name, position))
 
-    if user_data is None or not len(user_data) or len(user_data) < 15:
         if len(result):
             return result
         return
 
-    typ = struct.unpack("<B", user_data[:1])[0]
+    gesture = record
 
-    user_data = user_data[1:]
+    if gesture.mask & parse.GESTURE_WRIST:
+        result.append(osc_wrist(name, gesture.w_ang, gesture.h_ang, gesture.v_ang))
 
-    if typ == 4:
-        sequence, mask, w_ang, v_ang, h_ang, tap_d, tap_v, omni_d, omni_v, shake_d, shake_v, shake_du, lasso_d, lasso_v = struct.unpack(
-            '<BBbbbbbbbbbbbb', user_data[:14])
+    if gesture.mask & parse.GESTURE_TAP:
+        result.append(osc_tap(name, gesture.tap_d, gesture.tap_v, gesture.h_ang, gesture.v_ang))
 
-        if serial in cdp_dedup and cdp_dedup[serial] == sequence:
-            return
-        else:
-            cdp_dedup[serial] = sequence
+    if gesture.mask & parse.GESTURE_OMNI:
+        result.append(osc_omni(name, gesture.omni_d, gesture.omni_v, gesture.h_ang, gesture.v_ang))
 
-        if mask & 1:
-            result.append(osc_wrist(name, w_ang, h_ang, v_ang))
+    if gesture.mask & parse.GESTURE_SHAKE:
+        result.append(osc_shake(name, gesture.shake_d, gesture.shake_v, gesture.h_ang, gesture.v_ang))
 
-        if mask & 2:
-            result.append(osc_tap(name, tap_d, tap_v, h_ang, v_ang))
+    if len(result):
+        return result
 
-        if mask & 4:
-            result.append(osc_omni(name, omni_d, omni_v, h_ang, v_ang))
 
-        if mask & 8:
-            result.append(osc_shake(name, shake_d, shake_v, h_ang, v_ang))
+def handle_position_cdp_all(record):
+    """Video and music output from a single parse pass; route /midi/ to the music system.
+    """
+    result = (handle_position_cdp(record) or []) + (handle_position_cdp_music(record) or [])
 
     if len(result):
         return result
@@ -267,9 +250,12 @@ def handle_position_cdp(serial, position, user_data):
 
 lowpass_o1 = {}
 lowpass_o2 = {}
+lowpass_music = ({}, {})
+
 
+def position_smooth(serial, position, lowpass=(lowpass_o1, lowpass_o2)):
+    lowpass_o1, lowpass_o2 = lowpass
 
-def position_smooth(serial, position):
     if serial not in lowpass_o1:
         lowpass_o1[serial] = [0, 0, 0]
         lowpass_o2[serial] = [0, 0, 0]
@@ -442,11 +428,11 @@ def osc_wrist(*args):
 def osc_gesture(gesture, serial, *args):
     global sequence_event
     sequence_event += 1
-    return osc_message("/gesture/{}/{}".format(serial, gesture), sequence_event, *args)
+    return OSC.MessageTemplate.get("/gesture/{}/{}".format(serial, gesture), "i" * (len(args) + 1)).pack(sequence_event, *args)
 
 
 def osc_position(serial, position):
-    return osc_message("/position/{}".format(serial), *position)
+    return OSC.MessageTemplate.get("/position/{}".format(serial), "fff").pack(*position)
 
 
 def osc_midi_note_off(serial, note, velocity=0):
@@ -458,11 +444,7 @@ def osc_midi_note_on(serial, note, velocity=127):
 
 
 def osc_midi(serial, event, p1, p2):
-    return osc_message("/midi/dancer", event, p1, p2)
-
-
-def osc_message(path, *data):
-    return OSC.OSCMessage(path, data).getBinary()
+    return OSC.MessageTemplate.get("/midi/dancer", "iii").pack(event, p1, p2)
 
 
 def display_position(serial, position, data):
@@ -516,22 +498,31 @@ def main(args):
     if not args.out_port:
         args.out_port = args.port
 
-    handler = parse.parse_cdp
+    handler = parse.parse_cdp_records
 
     if args.debug:
+        handler = parse.parse_cdp
         position_handler = display_position
     else:
-        if args.music:
+        if args.all:
+            position_handler = handle_position_cdp_all
+        elif args.music:
             position_handler = handle_position_cdp_music
         else:
             position_handler = handle_position_cdp
 
-    fwd = forward.Forward(
-        args.input, args.port, args.out, args.out_port,
+        position_handler = parse.RecordFilter(position_handler)
+
+    fwd = forward.create(
+        args, args.input, args.port, args.out, args.out_port,
         iface=args.iface,
         iface_out=args.out_iface,
         verbose=False,
-        handler=lambda data: handler(data, position_handler)
+        handler=lambda data: handler(data, position_handler),
+        key=parse.cdp_key,
+        shard_key=parse.cdp_serial,
+        seq_key=parse.cdp_sequence,
+        routes=[forward.parse_route(route) for route in args.route or ()]
     )
 
     if params.log:
@@ -555,11 +546,15 @@ if __name__ == '__main__':
     parser.add_argument('-v', '--verbose', action='store_true', help='verbose output')
     parser.add_argument('-D', '--debug', action='store_true', help='debug mode')
     parser.add_argument('-M', '--music', action='store_true', help='music system mode (default: video system mode)')
+    parser.add_argument('-A', '--all', action='store_true', help='video and music system mode in one pass (see --route)')
+    parser.add_argument('-r', '--route', metavar='PREFIX=ADDR:PORT', action='append', help='send OSC addresses starting with PREFIX to ADDR:PORT (repeatable)')
     parser.add_argument('-l', '--log', metavar='LOGDIR', help='log positions to a folder, one file per drone')
+    forward.add_arguments(parser)
 
 
     try:
         params = parser.parse_args()
+        forward.check_arguments(parser, params)
 
         if params.log and not params.music:
             raise ValueError, "Cannot log in video mode"
@@ -180,15 +180,11 @@ def map_note(note_map, keys, lateral_position):
 
 def osc_midi(serial, event, p1, p2):
     # format: /drone [event, note, value]
-    return osc_message("/midi/drone", event, p1, p2)
+    return OSC.MessageTemplate.get("/midi/drone", "iii").pack(event, p1, p2)
 
 
 def osc_position(serial, position):
-    return osc_message("/position/drone/{:08X}".format(serial), position)
-
-
-def osc_message(path, *data):
-    return OSC.OSCMessage(path, data).getBinary()
+    return OSC.MessageTemplate.get("/position/drone/{:08X}".format(serial), "fff").pack(*position)
 
 
 def display_position(serial, position):
@@ -243,12 +239,12 @@ def main(args):
         else:
             position_handler = handle_position
 
-    fwd = forward.Forward(
-        args.input, args.port, args.out, args.out_port,
+    fwd = forward.create(
+        args, args.input, args.port, args.out, args.out_port,
         iface=args.iface,
         iface_out=args.out_iface,
         verbose=args.verbose,
-        handler=lambda data: handler(data, position_handler)
+        handler=lambda data: handler(data, position_handler, check_crc=args.crc)
     )
 
     if params.log:
@@ -273,9 +269,12 @@ if __name__ == '__main__':
     parser.add_argument('-D', '--debug', action='store_true', help='debug mode')
     parser.add_argument('-M', '--music', action='store_true', help='music system mode (default: video system mode)')
     parser.add_argument('-l', '--log', metavar='LOGDIR', help='log positions to a folder, one file per drone')
+    parser.add_argument('-C', '--crc', action='store_true', help='drop datagrams failing the DCC CRC check')
+    forward.add_arguments(parser)
 
     try:
         params = parser.parse_args()
+        forward.check_arguments(parser, params)
 
         if params.log and params.music:
             raise ValueError, "Cannot log in music mode"
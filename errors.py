@@ -0,0 +1,73 @@
+"""Error accounting for per-datagram code paths.
+
+Malformed input is counted by error class instead of printed once per datagram: each
+class is reported with its details the first time it occurs in an interval, and what
+follows is summed up in one line per interval, written from a timer thread.
+"""
+from __future__ import print_function
+import sys
+import threading
+
+INTERVAL = 1.0
+
+
+class ErrorLog(object):
+    """Counts errors by class (e.g. "cdp: bad mark") in 'counts' and reports them to stderr,
+    at most one detail line per class and one summary line per 'interval' seconds.
+    """
+    name = None
+    interval = INTERVAL
+    timer = None
+
+    def __init__(self, name, interval=INTERVAL):
+        self.name = name
+        self.interval = interval
+        self.counts = {}  # error class -> count since start (or reset())
+        self.pending = {}  # error class -> count not reported yet, for classes reported this interval
+        self.lock = threading.Lock()
+
+    def __call__(self, kind, detail="", *args):
+        """Count an error of class 'kind'. 'detail' is formatted with 'args' only if it is
+        printed.
+        """
+        with self.lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+
+            if kind in self.pending:
+                self.pending[kind] += 1
+                return
+
+            self.pending[kind] = 0
+
+            if self.timer is None:
+                self.timer = threading.Timer(self.interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+        print(kind + (": " + detail.format(*args) if detail else ""), file=sys.stderr)
+
+    def flush(self):
+        """Write the summary of what was not reported yet, and start a new interval.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.timer = None
+
+        missed = sorted((kind, count) for kind, count in pending.items() if count)
+
+        if missed:
+            print("{}: {} more errors in {:.0f}s: {}".format(
+                self.name, sum(count for kind, count in missed), self.interval,
+                ", ".join("{} x{}".format(kind, count) for kind, count in missed)
+            ), file=sys.stderr)
+
+    def reset(self):
+        """Forget all counts and anything not reported yet.
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+
+            self.timer = None
+            self.counts.clear()
+            self.pending.clear()
@@ -11,18 +11,51 @@ import random
 import threading
 import traceback
 import socket
+import select
+import errno
+import multiprocessing
 import ipaddress
+import ring
+import mmsg
+import stats
+import sequence
 
 class Udp(object):
+    RECV_SIZE = 4096
+
     addr = ("0.0.0.0", 0)
     dest = None
     sock = None
+    pool = None
+    batch = 0
+    timestamps = False
+    stamps = ()
 
-    def __init__(self, addr, port, sender=False, iface=None):
+    def __init__(self, addr, port, sender=False, iface=None, batch=0, rcvbuf=None, sndbuf=None, busy_poll=None,
+                 timestamps=False):
+        """Socket tuning: 'rcvbuf'/'sndbuf' set SO_RCVBUF/SO_SNDBUF in bytes, 'busy_poll' sets
+        SO_BUSY_POLL in microseconds, and 'timestamps' enables SO_TIMESTAMPNS on receivers.
+        With timestamps, recv_batch() leaves the kernel arrival time of each datagram in 'stamps'.
+        """
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        # self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16384)
-        # self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16384)
+
+        if sndbuf:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+
+        if rcvbuf and not sender:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+
+        if busy_poll and not sender:
+            self.sock.setsockopt(socket.SOL_SOCKET, mmsg.SO_BUSY_POLL, busy_poll)
+
+        if timestamps and not sender:
+            if mmsg.available:
+                self.sock.setsockopt(socket.SOL_SOCKET, mmsg.SO_TIMESTAMPNS, 1)
+                self.timestamps = True
+                batch = batch or 1
+            else:
+                print("<udp> kernel timestamps need recvmmsg, disabled", file=sys.stderr)
 
         addr_ip = socket.gethostbyname(addr)
         is_multicast = ipaddress.ip_address(unicode(addr_ip)).is_multicast
@@ -56,6 +89,44 @@ class Udp(object):
         elif not sender and iface is not None:
             print("<udp@{}> ignoring interface".format(self))
 
+        if batch and not sender:
+            self.batch = batch
+
+            if mmsg.available:
+                self.pool = mmsg.RecvPool(batch, Udp.RECV_SIZE, control=self.timestamps)
+            else:
+                self.pool = [memoryview(bytearray(Udp.RECV_SIZE)) for _ in range(batch)]
+
+    def recv_batch(self, block=True):
+        """Drain every queued datagram into the preallocated buffer pool.
+
+        Returns a list of memoryviews over the pool, which stay valid until the next call.
+        Uses one recvmmsg() call where available, otherwise a non-blocking recv_into() loop.
+        """
+        pool = self.pool
+
+        if type(pool) is not list:
+            batch = pool.recv(self.sock.fileno(), block)
+            self.stamps = pool.stamps
+            return batch
+
+        batch = []
+        flags = 0 if block else socket.MSG_DONTWAIT
+
+        for view in pool:
+            try:
+                size = self.sock.recv_into(view, Udp.RECV_SIZE, flags)
+
+            except socket.error as exc:
+                if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+
+            batch.append(view[:size])
+            flags = socket.MSG_DONTWAIT
+
+        return batch
+
     def __str__(self):
         return "{}:{}".format(*self.addr)
 
@@ -63,35 +134,358 @@ class Udp(object):
         return "{}:{}".format(*self.dest)
 
 
+class Sender(object):
+    """Collects outgoing messages and flushes them to a Udp sender in as few syscalls as possible.
+
+    A flush happens when 'max_messages' are pending, when the next message would push the
+    pending bytes past 'max_bytes', or when the oldest message has waited 'max_delay'
+    microseconds (0 means flush at the end of every processing cycle). With 'bundle' set,
+    pending messages are coalesced into a single OSC bundle datagram per flush.
+    """
+    MAX_MESSAGES = 64
+    MAX_BYTES = 1472  # 1500 byte MTU minus IP and UDP headers
+    BUNDLE_HEAD = "#bundle\0" + struct.pack(">LL", 0, 1)  # timetag 'immediately'
+
+    udp = None
+    pending = None
+    pending_bytes = 0
+    deadline = None
+    flushes = 0
+    sent = 0
+    stats = None
+
+    def __init__(self, udp, max_messages=MAX_MESSAGES, max_bytes=MAX_BYTES, max_delay=0, bundle=False):
+        self.udp = udp
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay / 1000000.0
+        self.bundle = bundle
+        self.pending = []
+        self.pending_bytes = len(Sender.BUNDLE_HEAD) if bundle else 0
+
+        if mmsg.send_available and not bundle and max_messages > 1:
+            self.vector = mmsg.SendVector(max_messages, udp.dest)
+        else:
+            self.vector = None
+
+    def add(self, message):
+        if type(message) is not str:
+            # e.g. the bytearray of OSCMessage.getBuffer(); joins and sendmmsg want str
+            message = message.tobytes() if type(message) is memoryview else bytes(message)
+
+        size = len(message) + 4 if self.bundle else len(message)
+
+        if self.pending and self.pending_bytes + size > self.max_bytes:
+            self.flush()
+
+        if not self.pending and self.max_delay:
+            self.deadline = time.time() + self.max_delay
+
+        self.pending.append(message)
+        self.pending_bytes += size
+
+        if len(self.pending) >= self.max_messages:
+            self.flush()
+
+    def timeout(self):
+        """Seconds until the pending messages are due, or None if there is nothing to wait for.
+        """
+        if not self.pending or self.deadline is None:
+            return None
+
+        return max(0.0, self.deadline - time.time())
+
+    def cycle(self):
+        """End of a processing cycle: flush unless the delay policy allows holding on.
+        """
+        if self.pending and (not self.max_delay or self.deadline <= time.time()):
+            self.flush()
+
+    def flush(self):
+        pending = self.pending
+
+        if not pending:
+            return
+
+        if self.stats is not None:
+            start = time.time()
+
+        sock = self.udp.sock
+        dest = self.udp.dest
+
+        # pending messages are dropped even if sending fails, so a bad one is not retried forever
+        self.pending = []
+        self.pending_bytes = len(Sender.BUNDLE_HEAD) if self.bundle else 0
+        self.deadline = None
+
+        if self.bundle:
+            if len(pending) == 1:
+                sock.sendto(pending[0], dest)
+            else:
+                sock.sendto(Sender.BUNDLE_HEAD + "".join(struct.pack(">i", len(m)) + m for m in pending), dest)
+
+        elif self.vector is not None and len(pending) > 1:
+            self.vector.send(sock.fileno(), pending)
+
+        else:
+            for message in pending:
+                sock.sendto(message, dest)
+
+        self.flushes += 1
+        self.sent += len(pending)
+
+        if self.stats is not None:
+            self.stats.hist["send"].record(time.time() - start)
+            self.stats.counters["messages_out"] += len(pending)
+
+
+class Router(object):
+    """Routes encoded OSC messages to destination senders by OSC address prefix.
+
+    A message goes to every sender whose prefix matches its address, or to the default
+    sender when no prefix matches (and is dropped if there is none). The verdict for
+    each distinct address is cached, since the set of addresses in a show is small.
+    """
+    default = None
+    routes = None
+    senders = None
+    cache = None
+
+    def __init__(self, default=None):
+        self.default = default
+        self.routes = []
+        self.senders = [default] if default is not None else []
+        self.cache = {}
+
+    def __str__(self):
+        out = [self.default.udp.dest_str()] if self.default is not None else []
+        out.extend("{}={}".format(prefix, sender.udp.dest_str()) for prefix, sender in self.routes)
+        return ", ".join(out)
+
+    def add_route(self, prefix, sender):
+        for known in self.senders:
+            if known.udp.dest == sender.udp.dest:
+                sender = known
+                break
+        else:
+            self.senders.append(sender)
+
+        self.routes.append((prefix, sender))
+        self.cache.clear()
+        return sender
+
+    def lookup(self, address):
+        targets = self.cache.get(address)
+
+        if targets is None:
+            targets = []
+
+            for prefix, sender in self.routes:
+                if address.startswith(prefix) and sender not in targets:
+                    targets.append(sender)
+
+            if not targets and self.default is not None:
+                targets.append(self.default)
+
+            targets = self.cache[address] = tuple(targets)
+
+        return targets
+
+    def add(self, message):
+        if not self.routes:
+            if self.default is not None:
+                self.default.add(message)
+            return
+
+        if type(message) is not str:
+            # the address is the cache key, so it has to be hashable
+            message = message.tobytes() if type(message) is memoryview else bytes(message)
+
+        for sender in self.lookup(message[:message.find("\0")]):
+            sender.add(message)
+
+    def timeout(self):
+        timeouts = [t for t in (sender.timeout() for sender in self.senders) if t is not None]
+        return min(timeouts) if timeouts else None
+
+    def cycle(self):
+        for sender in self.senders:
+            sender.cycle()
+
+    def flush(self):
+        for sender in self.senders:
+            sender.flush()
+
+
+class Input(object):
+    """One receive socket, the parsers every datagram from it is dispatched to, and the
+    batch parsers each received batch is passed to at once.
+    """
+    udp = None
+    key = None
+    parsers = None
+    batch_parsers = None
+
+    def __init__(self, udp, key):
+        self.udp = udp
+        self.key = key
+        self.parsers = []
+        self.batch_parsers = []
+
+    def __str__(self):
+        return str(self.udp)
+
+
 class Forward(object):
     QUEUE_MAX_LEN = 2048
+    OVERLOAD_POLICIES = ("block", "drop-oldest", "drop-newest", "keep-latest")
 
     udp_rx = None
     udp_tx = None
-    sem_prod = None
-    sem_cons = None
+    inputs = None
+    sender = None
+    router = None
     thr_rx = None
     thr_tx = None
     queue = None
+    batch = 0
+    overload = "block"
+    key = None
+    seq_key = None
+    tracker = None
+    latest = None
+    lock = None
+    shed = None
+    rx_stamp = None
+    udp_options = None
+    stats = None
+    reporter = None
     verbose = False
 
-    def __init__(self, src_addr, src_port, dst_addr, dst_port, iface=None, iface_out=None, verbose=False, handler=None):
-        self.sem_prod = threading.Semaphore(Forward.QUEUE_MAX_LEN)
-        self.sem_cons = threading.Semaphore(0)
-        self.udp_rx = Udp(src_addr, src_port, sender=False, iface=iface)
-        self.udp_tx = Udp(dst_addr, dst_port, sender=True, iface=iface_out)
+    def __init__(self, src_addr, src_port, dst_addr, dst_port, iface=None, iface_out=None, verbose=False, handler=None,
+                 batch=0, bundle=False, flush_count=Sender.MAX_MESSAGES, flush_bytes=Sender.MAX_BYTES, flush_delay=0,
+                 inputs=(), routes=(), overload="block", key=None, udp_options=None, stats_interval=0, stats_dest=None,
+                 seq_key=None, batch_handler=None):
+        """'inputs' lists extra (addr, port, iface, parser[, batch_parser]) sources. Sources sharing an
+        address, port and interface share one socket, and each datagram is passed to all of their parsers.
+        'src_addr' may be None when every source is given through 'inputs'.
+
+        A 'batch_handler' is called instead of 'handler' once per received batch, as
+        batch_handler(batch, stamps) with the datagrams (after any dropping and collapsing)
+        and their kernel arrival times, or None without timestamps. Like a handler, it returns
+        the message or list of messages to send. Handlers that decode a whole batch at once
+        save the per-datagram call overhead.
+
+        'routes' lists (prefix, addr, port) destinations for messages whose OSC address starts
+        with 'prefix'; messages matching no route go to 'dst_addr' (dropped if that is None).
+
+        'overload' selects what happens when processing falls behind reception:
+          - block: stop receiving until the queue has room (the kernel drops instead)
+          - drop-oldest: evict the oldest queued datagrams to make room
+          - drop-newest: discard datagrams that arrive while the queue is full
+          - keep-latest: replace a queued datagram with a newer one for the same key(data),
+            e.g. parse.cdp_key for the tag serial; unkeyed datagrams are dropped when full
+        Shed datagrams are counted per policy in 'shed'.
+
+        With 'seq_key' set (a function returning (source, sequence number) for a datagram, or
+        None, e.g. parse.cdp_sequence), datagrams repeating a sequence number already seen from
+        the same source on the same input are dropped on arrival, before any queueing or
+        parsing. 'tracker' (a sequence.Tracker) counts them along with gaps and reorders.
+
+        'udp_options' are passed on to every Udp (see Udp for buffer sizes, busy polling and
+        kernel timestamps). With timestamps enabled, batch handlers get the kernel arrival time
+        of each datagram as 'stamps', so they can account latency from the NIC onward ('rx_stamp'
+        also holds the time of the datagram being passed to a per-datagram handler).
+
+        With 'stats_interval' (seconds) or 'stats_dest' ((addr, port) for an OSC stats bundle) set,
+        the pipeline keeps per-stage latency histograms and counters in 'stats' and reports them
+        periodically (see the stats module).
+        """
+        if overload not in Forward.OVERLOAD_POLICIES:
+            raise ValueError("unknown overload policy '{}'".format(overload))
+
+        flush = (flush_count, flush_bytes, flush_delay, bundle)
+        self.udp_options = udp_options or {}
+
+        if handler is not None:
+            self.process = handler
+
+        self.batch = batch
+        self.inputs = []
+
+        if src_addr is not None:
+            if batch_handler is not None:
+                self.add_input(src_addr, src_port, iface, batch_parser=batch_handler)
+            else:
+                self.add_input(src_addr, src_port, iface, self.process)
+
+        for spec in inputs:
+            self.add_input(*spec)
+
+        self.udp_rx = self.inputs[0].udp
+
+        if dst_addr is not None:
+            self.udp_tx = Udp(dst_addr, dst_port, sender=True, iface=iface_out, **self.udp_options)
+            self.sender = Sender(self.udp_tx, *flush)
+
+        self.router = Router(self.sender)
+
+        for prefix, addr, port in routes:
+            self.router.add_route(prefix, Sender(Udp(addr, port, sender=True, iface=iface_out, **self.udp_options), *flush))
+
         self.thr_rx = threading.Thread(target=self._recv_task)
         self.thr_tx = threading.Thread(target=self._send_task)
-        self.queue = []
+        self.queue = ring.Ring(Forward.QUEUE_MAX_LEN)
+        self.overload = overload
+        self.key = key
+        self.seq_key = seq_key
+        self.latest = {}
+        self.shed = dict.fromkeys(Forward.OVERLOAD_POLICIES[1:], 0)
         self.verbose = verbose
 
-        if handler is not None:
-            self.process = handler
+        if overload in ("drop-oldest", "keep-latest"):
+            self.lock = threading.Lock()
+
+        if seq_key is not None:
+            self.tracker = sequence.Tracker("datagram")
+
+        if stats_interval or stats_dest:
+            self.stats = stats.Stats()
+            self.reporter = stats.Reporter(self, stats_interval or 1.0, stats_dest, quiet=not stats_interval)
+            self._arrivals = []
+
+            for sender in self.router.senders:
+                sender.stats = self.stats
 
     def __str__(self):
-        return "{} -> <{}> {}".format(self.udp_rx, self.udp_tx, self.udp_tx.dest_str())
+        return "{} -> {}".format(", ".join(str(i) for i in self.inputs), self.router)
+
+    def add_input(self, addr, port, iface=None, parser=None, batch_parser=None):
+        """Subscribe to another source (before start()). Returns its Input. Each datagram goes to
+        'parser' (the engine's handler when neither parser is given), each batch to 'batch_parser'.
+        """
+        addr_ip = socket.gethostbyname(addr)
+
+        for inp in self.inputs:
+            if inp.key == (addr_ip, port, iface):
+                break
+        else:
+            inp = Input(Udp(addr, port, sender=False, iface=iface, batch=self.batch, **self.udp_options),
+                        (addr_ip, port, iface))
+            self.inputs.append(inp)
+
+        if batch_parser is not None:
+            inp.batch_parsers.append(batch_parser)
+
+        if parser is not None or batch_parser is None:
+            inp.parsers.append(parser if parser is not None else self.process)
+
+        return inp
 
     def start(self):
+        if self.reporter is not None:
+            self.reporter.start()
+
         self.thr_rx.start()
         self.thr_tx.start()
 
@@ -104,55 +498,724 @@ class Forward(object):
 
     def _recv_task(self):
         try:
-            while 1:
-                self.sem_prod.acquire()
-                data, addr = self.udp_rx.sock.recvfrom(4096)
+            if len(self.inputs) == 1:
+                self._recv_single(self.inputs[0])
+            else:
+                self._recv_multi()
+
+        except KeyboardInterrupt:
+            sys.exit()
+
+    def _recv_single(self, inp):
+        queue = self.queue
+        udp_rx = inp.udp
+        block = self.overload == "block"
+
+        while 1:
+            if block:
+                queue.wait_writable()
+
+            stamps = None
+
+            if udp_rx.pool is not None:
+                # views alias the receive pool, so copy them out before handing off
+                batch = [view.tobytes() for view in udp_rx.recv_batch()]
+
+                if udp_rx.timestamps:
+                    stamps = udp_rx.stamps
+            else:
+                data, addr = udp_rx.sock.recvfrom(Udp.RECV_SIZE)
+                batch = (data,)
 
                 # if self.verbose:
                 #     print("[{}:{}] {}".format(addr[0], addr[1], " ".join("{:02X}".format(ord(b)) for b in data)), file=sys.stderr)
 
-                self.queue.append(data)
-                self.sem_cons.release()
+            if batch:
+                self._enqueue(inp, batch, stamps)
+
+    def _recv_multi(self):
+        queue = self.queue
+        poll = self._poller()
+        block = self.overload == "block"
+
+        while 1:
+            for fd, event in poll.poll():
+                inp = self._fds[fd]
+
+                if block:
+                    queue.wait_writable()
+
+                batch = [data.tobytes() if type(data) is memoryview else data for data in self._recv_ready(inp.udp)]
+
+                if batch:
+                    self._enqueue(inp, batch, inp.udp.stamps if inp.udp.timestamps else None)
+
+    def _enqueue(self, inp, batch, stamps=None):
+        """Queue a received batch for the send thread, applying the overload policy.
+        """
+        queue = self.queue
+        overload = self.overload
+        now = None
+
+        if self.stats is not None:
+            now = time.time()
+            self.stats.counters["packets_in"] += len(batch)
+
+        if self.seq_key is not None:
+            batch, stamps = self._track(inp, batch, stamps)
+
+            if not batch:
+                return
+
+        if overload == "block":
+            queue.push((inp, batch, stamps, now))
+
+        elif overload == "drop-oldest":
+            with self.lock:
+                while queue.full():
+                    self.shed[overload] += len(queue.pop()[1])
+
+                queue.push((inp, batch, stamps, now))
+
+        else:
+            if overload == "keep-latest" and self.key is not None:
+                batch, stamps = self._collapse(inp, batch, stamps, now)
+
+            if batch and not queue.push((inp, batch, stamps, now)):
+                self.shed[overload] += len(batch)
+
+    def _track(self, inp, batch, stamps):
+        """Drop the datagrams of a batch whose sequence number their source already sent.
+        Returns the rest of the batch and its stamps.
+        """
+        seq_key = self.seq_key
+        check = self.tracker.check
+        kept = []
+
+        for i, data in enumerate(batch):
+            k = seq_key(data)
+
+            if k is None or check((inp, k[0]), k[1]):
+                kept.append(i)
+
+        if len(kept) == len(batch):
+            return batch, stamps
+
+        if stamps is not None:
+            stamps = [stamps[i] for i in kept]
+
+        return [batch[i] for i in kept], stamps
+
+    def _collapse(self, inp, batch, stamps, now):
+        """Fold keyed datagrams into 'latest', queueing a marker only for keys not already pending.
+        Returns the unkeyed remainder of the batch and its stamps.
+        """
+        key = self.key
+        latest = self.latest
+        rest = []
+        rest_stamps = [] if stamps is not None else None
+
+        for i, data in enumerate(batch):
+            k = key(data)
+            stamp = stamps[i] if stamps is not None else None
+
+            if k is None:
+                rest.append(data)
+
+                if stamps is not None:
+                    rest_stamps.append(stamp)
+                continue
+
+            k = (inp, k)
+
+            with self.lock:
+                pending = k in latest
+                latest[k] = (data, stamp, now)
+
+            if pending:
+                self.shed["keep-latest"] += 1
+
+            elif not self.queue.push((None, k, None, None)):
+                with self.lock:
+                    del latest[k]
+
+                self.shed["keep-latest"] += 1
+
+        return rest, rest_stamps
+
+    def _dequeue(self):
+        """Drain the queue, resolving keep-latest markers to the freshest datagram for their key.
+        """
+        if self.lock is None:
+            return self.queue.drain()
+
+        with self.lock:
+            items = self.queue.drain()
+
+            for i, (inp, batch, stamps, queued) in enumerate(items):
+                if inp is None:
+                    inp = batch[0]
+                    data, stamp, queued = self.latest.pop(batch)
+                    items[i] = (inp, (data,), (stamp,) if inp.udp.timestamps else None, queued)
+
+        return items
+
+    def _poller(self):
+        """Returns an epoll object watching every (now non-blocking) input socket.
+        """
+        poll = select.epoll()
+        self._fds = {}
+
+        for inp in self.inputs:
+            inp.udp.sock.setblocking(False)
+            poll.register(inp.udp.sock.fileno(), select.EPOLLIN)
+            self._fds[inp.udp.sock.fileno()] = inp
+
+        return poll
+
+    def _recv_ready(self, udp):
+        """Receive what is queued on a non-blocking socket without waiting; at most one pool's worth.
+        """
+        if udp.pool is not None:
+            return udp.recv_batch(block=False)
+
+        batch = []
+
+        while 1:
+            try:
+                batch.append(udp.sock.recv(Udp.RECV_SIZE))
+
+            except socket.error as exc:
+                if exc.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return batch
+                raise
+
+    def _send_task(self):
+        try:
+            queue = self.queue
+            router = self.router
+
+            while 1:
+                if not queue.wait_readable(router.timeout()):
+                    self._send(router.flush)
+                    continue
+
+                for inp, batch, stamps, queued in self._dequeue():
+                    parsers = inp.parsers
+
+                    if self.stats is not None:
+                        self._arrived(batch, stamps, queued)
+
+                    if parsers:
+                        for i, data in enumerate(batch):
+                            if stamps is not None:
+                                self.rx_stamp = stamps[i]
+
+                            for parser in parsers:
+                                self._dispatch(parser, data)
+
+                    for parser in inp.batch_parsers:
+                        self._dispatch(parser, batch, stamps)
+
+                self._send(router.cycle)
+
+                if self.stats is not None:
+                    self._account()
 
         except KeyboardInterrupt:
             sys.exit()
 
-    def _send_task(self):
+    def _arrived(self, batch, stamps, queued):
+        """Note when each datagram of a batch arrived (kernel time if known) for 'total' latency.
+        """
+        if self.queue is not None:
+            wait = time.time() - queued
+            hist = self.stats.hist["queue"]
+
+            for i in range(len(batch)):
+                hist.record(wait)
+
+        if stamps is not None:
+            self._arrivals.extend(stamp if stamp is not None else queued for stamp in stamps)
+        else:
+            self._arrivals.extend([queued] * len(batch))
+
+    def _account(self):
+        """Record arrival-to-flush latency for the datagrams of the cycle that just ended.
+        """
+        now = time.time()
+        hist = self.stats.hist["total"]
+
+        for arrival in self._arrivals:
+            hist.record(now - arrival)
+
+        del self._arrivals[:]
+
+    def _dispatch(self, parser, *args):
+        stats = self.stats
+
         try:
+            if stats is None:
+                data = parser(*args)
+            else:
+                start = time.time()
+                data = parser(*args)
+                stats.hist["process"].record(time.time() - start)
+
+            if data:
+                if type(data) not in (list, tuple):
+                    data = (data,)
+
+                for message in data:
+                    self.router.add(message)
+
+        except KeyboardInterrupt:
+            raise
+
+        except:
+            self._failed()
+
+    def _send(self, send, *args):
+        """Run a router add, flush or cycle, reporting a failure like a handler's instead of
+        letting it end the sending thread.
+        """
+        try:
+            send(*args)
+
+        except KeyboardInterrupt:
+            raise
+
+        except:
+            self._failed()
+
+    def _failed(self):
+        traceback.print_exc()
+
+        if self.stats is not None:
+            self.stats.counters["errors"] += 1
+
+    def process(self, data):
+        return data
+
+
+class LoopForward(Forward):
+    """Single event-loop variant of Forward.
+
+    Receive, process and send all happen on one thread driven by epoll, so packets are
+    never handed across threads. Constructor and handler contract match Forward.
+    Received datagrams are processed in place, straight out of the receive pool.
+    There is no queue to overload; the keep-latest policy is applied within each
+    receive batch and the other policies have no effect.
+    """
+    thr_loop = None
+
+    def __init__(self, *args, **kwargs):
+        super(LoopForward, self).__init__(*args, **kwargs)
+        self.thr_rx = None
+        self.thr_tx = None
+        self.queue = None
+        self.thr_loop = threading.Thread(target=self.run)
+
+    def start(self):
+        if self.reporter is not None:
+            self.reporter.start()
+
+        self.thr_loop.start()
+
+    def join(self):
+        while self.thr_loop.isAlive():
+            self.thr_loop.join(0.25)
+
+    def run(self):
+        try:
+            router = self.router
+            poll = self._poller()
+            fds = self._fds
+
             while 1:
-                self.sem_cons.acquire()
-                data = self.queue.pop(0)
-                self.sem_prod.release()
+                timeout = router.timeout()
 
                 try:
-                    data = self.process(data)
+                    events = poll.poll(-1 if timeout is None else timeout)
 
-                except KeyboardInterrupt:
+                except IOError as exc:
+                    if exc.errno == errno.EINTR:
+                        continue
                     raise
 
-                except:
-                    traceback.print_exc()
-                    data = None
+                if not events:
+                    self._send(router.flush)
+                    continue
 
-                if data:
-                    if type(data) not in (list, tuple):
-                        data = (data,)
+                for fd, event in events:
+                    self._drain(fds[fd])
 
-                    for message in data:
-                        self.udp_tx.sock.sendto(message, self.udp_tx.dest)
+                self._send(router.cycle)
+
+                if self.stats is not None:
+                    self._account()
 
         except KeyboardInterrupt:
             sys.exit()
 
-    def process(self, data):
-        return data
+    def _drain(self, inp):
+        """Process every datagram queued on an input socket.
+        """
+        udp = inp.udp
+        parsers = inp.parsers
+        collapse = self.overload == "keep-latest" and self.key is not None
+
+        while 1:
+            batch = self._recv_ready(udp)
+            received = len(batch)
+            stamps = udp.stamps if udp.timestamps else None
+
+            if self.seq_key is not None and batch:
+                batch, stamps = self._track(inp, batch, stamps)
+
+            if collapse and len(batch) > 1:
+                batch, stamps = self._collapse_batch(batch, stamps)
+
+            if self.stats is not None and batch:
+                self.stats.counters["packets_in"] += received
+                self._arrived(batch, stamps, time.time())
+
+            if parsers:
+                for i, data in enumerate(batch):
+                    if stamps is not None:
+                        self.rx_stamp = stamps[i]
+
+                    for parser in parsers:
+                        self._dispatch(parser, data)
+
+            if batch:
+                for parser in inp.batch_parsers:
+                    self._dispatch(parser, batch, stamps)
+
+            if udp.pool is None or received < udp.batch:
+                return
+
+    def _collapse_batch(self, batch, stamps):
+        """Drop datagrams superseded by a newer one for the same key within the batch.
+        """
+        key = self.key
+        keys = [key(data) for data in batch]
+        last = dict((k, i) for i, k in enumerate(keys) if k is not None)
+        kept = [i for i, k in enumerate(keys) if k is None or last[k] == i]
+        self.shed["keep-latest"] += len(batch) - len(kept)
+
+        if stamps is not None:
+            stamps = [stamps[i] for i in kept]
+
+        return [batch[i] for i in kept], stamps
+
+
+class ShardOutput(object):
+    """Stands in for a worker's Router: pushes every produced message to the merge stage.
+    """
+    ring = None
+
+    def __init__(self, ring):
+        self.ring = ring
+
+    def add(self, message):
+        if type(message) is not str:
+            message = message.tobytes() if type(message) is memoryview else bytes(message)
+
+        while not self.ring.push(message):
+            time.sleep(ShardForward.FULL_WAIT)
+
+
+class ShardForward(Forward):
+    """Multi-process variant of Forward that spreads processing over 'shards' worker processes.
+
+    The front process receives datagrams and hands each one to a worker chosen by
+    'shard_key(data)' (the tag serial, e.g. parse.cdp_serial), so all state a handler keeps
+    per serial lives in exactly one worker. Datagrams without a key all go to the first
+    worker. Workers run the parsers and push the resulting messages back over a second
+    ring, and a merge thread in the front process routes and sends them.
+
+    Rings are shared memory (ring.ShmRing) and workers are fork()ed on start(), so handlers
+    and their module state are inherited as they are at that point; anything a handler
+    keeps globally (counters, caches) is per worker from then on.
+
+    Kernel timestamps and the keep-latest policy are not supported, and batch handlers get
+    None stamps. A full worker ring either blocks the receiver ('block') or sheds the
+    datagram ('drop-oldest' and 'drop-newest' both shed the newest, as the oldest is
+    already in the worker's hands).
+    """
+    RING_SIZE = 1 << 20
+    FULL_WAIT = 0.0001
+
+    shards = None
+    outputs = None
+    shard_key = None
+    workers = None
+
+    def __init__(self, *args, **kwargs):
+        count = kwargs.pop("shards", 2)
+        self.shard_key = kwargs.pop("shard_key", None) or kwargs.get("key")
+
+        if kwargs.get("overload") == "keep-latest":
+            raise ValueError("the keep-latest policy is not supported with shards")
+
+        if (kwargs.get("udp_options") or {}).get("timestamps"):
+            raise ValueError("kernel timestamps are not supported with shards")
+
+        super(ShardForward, self).__init__(*args, **kwargs)
+
+        if count < 1:
+            raise ValueError("shard count must be positive")
+
+        if len(self.inputs) > 256:
+            raise ValueError("too many inputs to shard")
+
+        self.queue = None
+        self.thr_tx = threading.Thread(target=self._merge_task)
+        self.shards = [ring.ShmRing(ShardForward.RING_SIZE) for _ in range(count)]
+        self.outputs = [ring.ShmRing(ShardForward.RING_SIZE) for _ in range(count)]
+        self.workers = []
+
+    def __str__(self):
+        return "{} ({} shards)".format(super(ShardForward, self).__str__(), len(self.shards))
+
+    def start(self):
+        for index in range(len(self.shards)):
+            worker = multiprocessing.Process(target=self._worker_task, args=(index,))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+        super(ShardForward, self).start()
+
+    def _recv_task(self):
+        try:
+            poll = self._poller()
+
+            while 1:
+                for fd, event in poll.poll():
+                    inp = self._fds[fd]
+                    batch = self._recv_ready(inp.udp)
+
+                    if batch:
+                        self._enqueue(inp, batch)
+
+        except KeyboardInterrupt:
+            sys.exit()
+
+    def _enqueue(self, inp, batch, stamps=None):
+        """Hand each datagram of a batch to the worker owning its key.
+        """
+        shards = self.shards
+        key = self.shard_key
+        block = self.overload == "block"
+        tag = chr(self.inputs.index(inp))
+
+        if self.stats is not None:
+            self.stats.counters["packets_in"] += len(batch)
+
+        if self.seq_key is not None:
+            batch = self._track(inp, batch, None)[0]
+
+        for data in batch:
+            if type(data) is memoryview:
+                data = data.tobytes()
+
+            k = key(data) if key is not None else None
+            shard = shards[hash(k) % len(shards)] if k is not None else shards[0]
+
+            while not shard.push(tag + data):
+                if not block:
+                    self.shed[self.overload] += 1
+                    break
+
+                time.sleep(ShardForward.FULL_WAIT)
+
+    def _worker_task(self, index):
+        """Worker process body: parse everything queued for this shard.
+        """
+        # the front process keeps the sockets, counters and reporting; sequence trackers
+        # count into this worker's own row
+        self.stats = None
+        sequence.slot = (index + 1) % sequence.SLOTS
+        self.router = ShardOutput(self.outputs[index])
+        shard = self.shards[index]
+        inputs = self.inputs
+        parent = os.getppid()
+
+        try:
+            while 1:
+                items = shard.drain()
+
+                if not items:
+                    sequence.publish()
+
+                    # wait_readable() returns at least every ShmRing.PARK_MAX seconds, so a
+                    # worker outlives a front process that died without cleaning up only briefly
+                    if not shard.wait_readable() and os.getppid() != parent:
+                        return
+
+                    continue
+
+                batches = {}
+
+                for record in items:
+                    inp = inputs[ord(record[0])]
+                    data = record[1:]
+
+                    for parser in inp.parsers:
+                        self._dispatch(parser, data)
+
+                    if inp.batch_parsers:
+                        batches.setdefault(inp, []).append(data)
+
+                # batch parsers get what was drained for their input in one call
+                for inp, batch in batches.items():
+                    for parser in inp.batch_parsers:
+                        self._dispatch(parser, batch, None)
+
+        except KeyboardInterrupt:
+            pass
+
+    def _merge_task(self):
+        """Route and send what the workers produce.
+        """
+        try:
+            router = self.router
+            outputs = self.outputs
+            poll = select.epoll()
+
+            for output in outputs:
+                poll.register(output.fileno(), select.EPOLLIN)
+
+            while 1:
+                merged = 0
+
+                for output in outputs:
+                    for message in output.drain():
+                        self._send(router.add, message)
+                        merged += 1
+
+                self._send(router.cycle)
+
+                if merged:
+                    continue
+
+                # park on every ring before sleeping, so a push to any of them wakes us
+                if all([output.park() for output in outputs]):
+                    timeout = router.timeout()
+
+                    try:
+                        poll.poll(ring.ShmRing.PARK_MAX if timeout is None else min(timeout, ring.ShmRing.PARK_MAX))
+
+                    except IOError as exc:
+                        if exc.errno != errno.EINTR:
+                            raise
+
+                for output in outputs:
+                    output.unpark()
+
+        except KeyboardInterrupt:
+            sys.exit()
+
+
+def parse_dest(spec):
+    """Parse an 'ADDR:PORT' specification into an (addr, port) tuple.
+    """
+    addr, port = spec.rsplit(':', 1)
+    return addr, int(port)
+
+
+def parse_route(spec):
+    """Parse a 'PREFIX=ADDR:PORT' route specification into a (prefix, addr, port) tuple.
+    """
+    prefix, dest = spec.split('=', 1)
+    return (prefix,) + parse_dest(dest)
+
+
+def add_arguments(parser):
+    """Add the engine, queueing and socket tuning options shared by the forwarding scripts.
+    """
+    parser.add_argument('-B', '--batch', metavar='COUNT', type=int, default=0, help='receive up to COUNT datagrams per syscall')
+    parser.add_argument('-L', '--loop', action='store_true', help='single-threaded epoll engine')
+    parser.add_argument('-S', '--shards', metavar='COUNT', type=int, default=0, help='process in COUNT worker processes, sharded by tag serial')
+    parser.add_argument('--overload', choices=Forward.OVERLOAD_POLICIES, default='block', help='overload policy')
+    parser.add_argument('-b', '--bundle', action='store_true', help='coalesce outgoing messages into OSC bundles')
+    parser.add_argument('--flush-count', metavar='COUNT', type=int, default=Sender.MAX_MESSAGES, help='max messages per flush')
+    parser.add_argument('--flush-bytes', metavar='BYTES', type=int, default=Sender.MAX_BYTES, help='max bytes per flush')
+    parser.add_argument('--flush-delay', metavar='USEC', type=int, default=0, help='max microseconds to hold a message')
+    parser.add_argument('--rcvbuf', metavar='BYTES', type=int, help='socket receive buffer size')
+    parser.add_argument('--sndbuf', metavar='BYTES', type=int, help='socket send buffer size')
+    parser.add_argument('--busy-poll', metavar='USEC', type=int, help='SO_BUSY_POLL on receive sockets')
+    parser.add_argument('--timestamps', action='store_true', help='kernel receive timestamps (SO_TIMESTAMPNS)')
+    parser.add_argument('--stats', metavar='SECONDS', type=float, default=0, help='print pipeline stats every SECONDS')
+    parser.add_argument('--stats-dest', metavar='ADDR:PORT', help='send pipeline stats as OSC to ADDR:PORT')
+
+
+def check_arguments(parser, args):
+    """Reject add_arguments() options that do not combine, through parser.error().
+    """
+    try:
+        check_engine(args)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+
+def check_engine(args):
+    """Raise ValueError for add_arguments() options the selected engine would not honour.
+    """
+    if args.shards and args.loop:
+        raise ValueError("--shards and --loop select different engines")
+
+    if args.shards and args.overload == "keep-latest":
+        raise ValueError("--overload keep-latest is not supported with --shards")
+
+    if args.shards and args.timestamps:
+        raise ValueError("--timestamps is not supported with --shards")
+
+
+def create(args, *posargs, **kwargs):
+    """Build a Forward (a LoopForward with --loop, a ShardForward with --shards) from
+    add_arguments() options. Keyword arguments override the parsed options; 'shard_key'
+    is only passed on to a ShardForward.
+    """
+    check_engine(args)
+
+    if args.shards:
+        engine = ShardForward
+        kwargs.setdefault("shards", args.shards)
+    else:
+        engine = LoopForward if args.loop else Forward
+        kwargs.pop("shard_key", None)
+
+    options = dict(
+        batch=args.batch,
+        overload=args.overload,
+        bundle=args.bundle,
+        flush_count=args.flush_count,
+        flush_bytes=args.flush_bytes,
+        flush_delay=args.flush_delay,
+        udp_options=dict(rcvbuf=args.rcvbuf, sndbuf=args.sndbuf, busy_poll=args.busy_poll, timestamps=args.timestamps),
+        stats_interval=args.stats,
+        stats_dest=parse_dest(args.stats_dest) if args.stats_dest else None
+    )
+    options.update(kwargs)
+    return engine(*posargs, **options)
 
 
 def main(args):
     if not args.out_port:
         args.out_port = args.port
 
-    fwd = Forward(args.input, args.port, args.out, args.out_port, args.iface, args.out_iface, args.verbose)
+    inputs = []
+
+    for extra in args.also or ():
+        inputs.append(parse_dest(extra) + (args.iface, None))
+
+    routes = [parse_route(route) for route in args.route or ()]
+
+    fwd = create(args, args.input, args.port, args.out, args.out_port, args.iface, args.out_iface, args.verbose,
+                 inputs=inputs, routes=routes)
 
     print(fwd)
     fwd.start()
@@ -163,13 +1226,18 @@ if __name__ == '__main__':
     parser.add_argument('-I', '--iface', metavar='ADDR', required=False, help='source iface address (NOT name!)')
     parser.add_argument('-i', '--input', metavar='ADDR', required=True, help='source address')
     parser.add_argument('-p', '--port', metavar='PORT', type=int, required=True, help='source port')
+    parser.add_argument('-a', '--also', metavar='ADDR:PORT', action='append', help='additional source (repeatable)')
     parser.add_argument('-o', '--out', metavar='ADDR', required=True, help='destination address')
     parser.add_argument('-O', '--out-iface', metavar='ADDR', required=False, help='outgoing iface address (NOT name!)')
     parser.add_argument('-P', '--out-port', metavar='PORT', type=int, help='destination port')
+    parser.add_argument('-r', '--route', metavar='PREFIX=ADDR:PORT', action='append', help='send OSC addresses starting with PREFIX to ADDR:PORT (repeatable)')
     parser.add_argument('-v', '--verbose', action='store_true', help='verbose output')
+    add_arguments(parser)
 
     try:
-        main(parser.parse_args())
+        params = parser.parse_args()
+        check_arguments(parser, params)
+        main(params)
 
     except KeyboardInterrupt:
         pass
@@ -3,7 +3,6 @@
 """
 from __future__ import print_function
 import sys
-import struct
 import argparse
 import traceback
 import forward
@@ -12,17 +11,18 @@ import parse
 POSITION_SAMPLE_COUNT = 5
 
 cdp_pos = {}
-cdp_dedup = {}
 pos_post = {}
 cdp_out = {}
 
 
-def handle_position_cdp(serial, position, user_data):
-    if position is not None:
+def handle_position_cdp(record):
+    serial = record.serial
+
+    if type(record) is parse.PositionRecord:
         if serial in cdp_pos:
-            cdp_pos[serial].append(position)
+            cdp_pos[serial].append(record.position)
         else:
-            cdp_pos[serial] = [position]
+            cdp_pos[serial] = [record.position]
 
     if serial not in pos_post:
         pos_post[serial] = False
@@ -43,32 +43,20 @@ def handle_position_cdp(serial, position, user_data):
     elif serial in cdp_pos and len(cdp_pos[serial]) > 100:
         cdp_pos[serial] = cdp_pos[serial][100:]
 
-    if user_data is None or not len(user_data) or len(user_data) < 12:
+    if type(record) is not parse.GestureRecord:
         return
 
-    typ = struct.unpack("<B", user_data[:1])[0]
-    user_data = user_data[1:]
-
-    if typ == 4:
-        sequence, mask, w_ang, v_ang, h_ang, tap_d, tap_v, omni_d, omni_v, shake_d, shake_v, shake_du, lasso_d, lasso_v = struct.unpack(
-            '<BBbbbbbbbbbbbb', user_data[:14])
-
-        if serial in cdp_dedup and cdp_dedup[serial] == sequence:
-            return
-        else:
-            cdp_dedup[serial] = sequence
-
-        if (not pos_post[serial]) and (mask & 2) and (serial in cdp_pos):
-            cdp_out[serial] = []
+    if (not pos_post[serial]) and (record.mask & parse.GESTURE_TAP) and (serial in cdp_pos):
+        cdp_out[serial] = []
 
-            for position in cdp_pos[serial][-POSITION_SAMPLE_COUNT:]:
-                cdp_out[serial].append("{:08X}: {}".format(
-                    serial, " ".join(str(round(p, 3)).rjust(12) for p in position)
-                ))
+        for position in cdp_pos[serial][-POSITION_SAMPLE_COUNT:]:
+            cdp_out[serial].append("{:08X}: {}".format(
+                serial, " ".join(str(round(p, 3)).rjust(12) for p in position)
+            ))
 
-            cdp_out[serial].append("{:08X}: hit".format(serial))
-            cdp_pos[serial] = []
-            pos_post[serial] = True
+        cdp_out[serial].append("{:08X}: hit".format(serial))
+        cdp_pos[serial] = []
+        pos_post[serial] = True
 
 
 def display_position(serial, position, data):
@@ -87,14 +75,17 @@ def display_position(serial, position, data):
 
 
 def main(args):
-    handler = parse.parse_cdp
-    position_handler = handle_position_cdp
+    handler = parse.parse_cdp_records
+    position_handler = parse.RecordFilter(handle_position_cdp)
 
-    fwd = forward.Forward(
-        args.input, args.port, "127.0.0.1", args.port,
+    fwd = forward.create(
+        args, args.input, args.port, "127.0.0.1", args.port,
         iface=args.iface,
         verbose=False,
-        handler=lambda data: handler(data, position_handler)
+        handler=lambda data: handler(data, position_handler),
+        key=parse.cdp_key,
+        shard_key=parse.cdp_serial,
+        seq_key=parse.cdp_sequence
     )
 
     print(fwd)
@@ -108,9 +99,11 @@ if __name__ == '__main__':
     parser.add_argument('-I', '--iface', metavar='ADDR', required=False, help='source interface address (NOT name!)')
     parser.add_argument('-i', '--input', metavar='ADDR', required=True, help='source address')
     parser.add_argument('-p', '--port', metavar='PORT', type=int, required=True, help='source port')
+    forward.add_arguments(parser)
 
     try:
         params = parser.parse_args()
+        forward.check_arguments(parser, params)
         main(params)
 
     except KeyboardInterrupt:
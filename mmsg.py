@@ -0,0 +1,230 @@
+"""Batched datagram syscalls (Linux recvmmsg/sendmmsg) through ctypes.
+
+Everything here is optional: 'available' is False when libc does not export the
+call, and callers are expected to fall back to plain socket methods.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import socket
+import struct
+
+MSG_DONTWAIT = 0x40
+MSG_WAITFORONE = 0x10000
+
+SOL_SOCKET = 1
+SO_TIMESTAMPNS = 35
+SCM_TIMESTAMPNS = SO_TIMESTAMPNS
+SO_BUSY_POLL = 46
+
+CMSG_HDR = struct.Struct("@Lii")  # cmsg_len, cmsg_level, cmsg_type
+TIMESPEC = struct.Struct("@ll")
+CONTROL_SIZE = 64
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", msghdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    _recvmmsg = _libc.recvmmsg
+    _recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    _recvmmsg.restype = ctypes.c_int
+    available = True
+
+except (OSError, AttributeError):
+    _libc = None
+    _recvmmsg = None
+    available = False
+
+try:
+    _sendmmsg = _libc.sendmmsg
+    _sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+    _sendmmsg.restype = ctypes.c_int
+    send_available = True
+
+except AttributeError:
+    _sendmmsg = None
+    send_available = False
+
+
+def sockaddr_in(dest):
+    """Pack a (host, port) tuple as a struct sockaddr_in.
+    """
+    host, port = dest
+    return struct.pack("=H", socket.AF_INET) + struct.pack("!H", port) + socket.inet_aton(host) + "\0" * 8
+
+
+class RecvPool(object):
+    """Preallocated receive buffers plus the mmsghdr vector pointing into them.
+
+    recv() fills as many buffers as there are queued datagrams and returns memoryviews
+    over the filled part of each. The views alias the pool and are only valid until
+    the next call.
+
+    With 'control' set, each message also gets an ancillary data buffer, and the
+    SCM_TIMESTAMPNS kernel receive time of each returned datagram (float seconds, or
+    None if absent) is left in 'stamps'.
+    """
+    count = 0
+    size = 0
+    buffers = None
+    views = None
+    control = False
+    stamps = None
+
+    def __init__(self, count, size, control=False):
+        self.count = count
+        self.size = size
+        self.control = control
+        self.buffers = [bytearray(size) for _ in range(count)]
+        self.views = [memoryview(buf) for buf in self.buffers]
+        self._cbufs = [(ctypes.c_char * size).from_buffer(buf) for buf in self.buffers]
+        self._iov = (iovec * count)()
+        self._hdr = (mmsghdr * count)()
+        self.stamps = []
+
+        if control:
+            self._control = [ctypes.create_string_buffer(CONTROL_SIZE) for _ in range(count)]
+
+        for i, cbuf in enumerate(self._cbufs):
+            self._iov[i].iov_base = ctypes.addressof(cbuf)
+            self._iov[i].iov_len = size
+            self._hdr[i].msg_hdr.msg_iov = ctypes.pointer(self._iov[i])
+            self._hdr[i].msg_hdr.msg_iovlen = 1
+
+            if control:
+                self._hdr[i].msg_hdr.msg_control = ctypes.addressof(self._control[i])
+
+    def recv(self, fd, block=True):
+        """Receive up to 'count' datagrams with a single syscall.
+        Blocks for the first datagram only if 'block' is set. Returns [] if nothing is queued.
+        """
+        flags = MSG_WAITFORONE if block else MSG_DONTWAIT
+
+        if self.control:
+            # the kernel shrinks msg_controllen to what it wrote, so reset it every call
+            for i in range(self.count):
+                self._hdr[i].msg_hdr.msg_controllen = CONTROL_SIZE
+
+        while 1:
+            received = _recvmmsg(fd, self._hdr, self.count, flags, None)
+
+            if received >= 0:
+                break
+
+            err = ctypes.get_errno()
+
+            if err == errno.EINTR:
+                continue
+
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+
+            raise OSError(err, os.strerror(err))
+
+        hdr = self._hdr
+        views = self.views
+
+        if self.control:
+            self.stamps = [self._timestamp(i) for i in range(received)]
+
+        return [views[i][:hdr[i].msg_len] for i in range(received)]
+
+    def _timestamp(self, index):
+        """Walk the ancillary data of a received message looking for SCM_TIMESTAMPNS.
+        """
+        control = self._control[index].raw
+        end = self._hdr[index].msg_hdr.msg_controllen
+        offset = 0
+        align = ctypes.sizeof(ctypes.c_size_t)
+
+        while offset + CMSG_HDR.size <= end:
+            length, level, typ = CMSG_HDR.unpack_from(control, offset)
+
+            if length < CMSG_HDR.size:
+                break
+
+            if level == SOL_SOCKET and typ == SCM_TIMESTAMPNS:
+                sec, nsec = TIMESPEC.unpack_from(control, offset + CMSG_HDR.size)
+                return sec + nsec / 1e9
+
+            offset += (length + align - 1) & ~(align - 1)
+
+        return None
+
+
+class SendVector(object):
+    """Preallocated mmsghdr vector for sending a list of datagrams to one destination.
+    """
+    count = 0
+
+    def __init__(self, count, dest):
+        self.count = count
+        name = sockaddr_in(dest)
+        self._name = ctypes.create_string_buffer(name, len(name))
+        self._iov = (iovec * count)()
+        self._hdr = (mmsghdr * count)()
+
+        for i in range(count):
+            self._hdr[i].msg_hdr.msg_name = ctypes.addressof(self._name)
+            self._hdr[i].msg_hdr.msg_namelen = len(name)
+            self._hdr[i].msg_hdr.msg_iov = ctypes.pointer(self._iov[i])
+            self._hdr[i].msg_hdr.msg_iovlen = 1
+
+    def send(self, fd, messages):
+        """Send every message, issuing one sendmmsg() call per 'count' messages.
+        """
+        iov = self._iov
+        offset = 0
+        total = len(messages)
+
+        while offset < total:
+            chunk = messages[offset:offset + self.count]
+            # keep the char pointers alive until the syscall returns
+            refs = [ctypes.c_char_p(message) for message in chunk]
+
+            for i, ref in enumerate(refs):
+                iov[i].iov_base = ctypes.cast(ref, ctypes.c_void_p).value
+                iov[i].iov_len = len(chunk[i])
+
+            sent = 0
+
+            while sent < len(chunk):
+                result = _sendmmsg(fd, ctypes.byref(self._hdr[sent]), len(chunk) - sent, 0)
+
+                if result < 0:
+                    err = ctypes.get_errno()
+
+                    if err == errno.EINTR:
+                        continue
+
+                    raise OSError(err, os.strerror(err))
+
+                sent += result
+
+            offset += len(chunk)
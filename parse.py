@@ -1,6 +1,13 @@
 from __future__ import print_function
-import sys
 import struct
+import errors
+import protocol
+import sequence
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 MSG_UWB_EVT_TAG_LOC_CHANGED = 0x88
 MSG_UWB_EVT_ANCHOR_LOC_CHANGED = 0x89
@@ -14,41 +21,155 @@ CDP_VERSN = "CDP0002\0"
 CDP_T_USER = 0x0007
 CDP_T_POS = 0x0100
 
+CDP_HEADER = struct.Struct("<II8sI")  # mark, sequence, version, serial
+CDP_RECORD = struct.Struct("<HH")  # type, size
+CDP_POSITION = struct.Struct("<iiiIHHI")  # x, y, z (mm), quality, smoothing, sequence, network time
+CDP_VERSN_WORD = struct.unpack("<Q", CDP_VERSN)[0]  # the version as numpy compares it
+CDP_GESTURE = struct.Struct("<BBbbbbbbbbbbbb")  # follows the 0x04 subtype byte of a user record
+
+GESTURE_WRIST = 0x01  # GestureRecord.mask bits
+GESTURE_TAP = 0x02
+GESTURE_OMNI = 0x04
+GESTURE_SHAKE = 0x08
+
+LCM_HEADER = struct.Struct(">II")  # magic, sequence
+CIH_HEADER = struct.Struct(">I")  # magic
+LCM_P3 = struct.Struct(">HIHffffBQH")  # payload size, serial, network, x, y, z, quality, smoothing, timestamp, user size
+LCM_CHANNELS = {}  # channel name -> decoder, see lcm_channel()
+
+ERRORS = errors.ErrorLog("parse")  # malformed datagrams, by error class
+
+DCC_HEADER = struct.Struct("<3sBHHHI")  # sync code, type, source, destination, sequence, data length
+DCC_CRC = struct.Struct("<H")
+DCC_ENTRY = "IBfff"  # ms timestamp, index, x, y, z
+DCC_ENTRY_SIZE = struct.calcsize("<" + DCC_ENTRY)
+DCC_ENTRIES = {}
+DCC_CRC_TABLE = []
+
+for _byte in range(256):
+    _crc = _byte << 8
+
+    for _bit in range(8):
+        _crc = ((_crc << 1) ^ 0x1021 if _crc & 0x8000 else _crc << 1) & 0xFFFF
+
+    DCC_CRC_TABLE.append(_crc)
+
+del _byte, _bit, _crc
+
+if numpy is not None:
+    # decoded tag locations, as returned by dcc_positions()
+    DCC_POSITION_DTYPE = numpy.dtype([("ts", "<f8"), ("id", "<u4"), ("x", "<f8"), ("y", "<f8"), ("z", "<f8")])
+    DCC_ENTRY_RAW = numpy.dtype([("ts", "<u4"), ("idx", "u1"), ("x", "<f4"), ("y", "<f4"), ("z", "<f4")])
+
+    # decoded position records, as returned by cdp_positions()
+    CDP_POSITION_DTYPE = numpy.dtype([
+        ("serial", "<u4"), ("x", "<f8"), ("y", "<f8"), ("z", "<f8"),
+        ("quality", "<u4"), ("smoothing", "<u2"), ("sequence", "<u2"), ("network_time", "<u4")
+    ])
+
+    # wire layouts of a position record and of a datagram carrying nothing but one
+    CDP_POSITION_RAW = numpy.dtype([
+        ("x", "<i4"), ("y", "<i4"), ("z", "<i4"),
+        ("quality", "<u4"), ("smoothing", "<u2"), ("sequence", "<u2"), ("network_time", "<u4")
+    ])
+    CDP_POSITION_FRAME = numpy.dtype([
+        ("mark", "<u4"), ("seq", "<u4"), ("version", "<u8"), ("serial", "<u4"),
+        ("type", "<u2"), ("size", "<u2"), ("position", CDP_POSITION_RAW)
+    ])
+
+
+class PositionRecord(object):
+    """A decoded CDP position record; 'position' is (x, y, z) in metres.
+    """
+    __slots__ = ("serial", "position", "quality", "smoothing", "sequence", "network_time")
+
+    def __init__(self, serial, position, quality, smoothing, sequence, network_time):
+        self.serial = serial
+        self.position = position
+        self.quality = quality
+        self.smoothing = smoothing
+        self.sequence = sequence
+        self.network_time = network_time
+
+    def __repr__(self):
+        return "PositionRecord({:08X}, {})".format(self.serial, self.position)
+
+
+class GestureRecord(object):
+    """A decoded CDP gesture (user record subtype 0x04). 'mask' tells which of the gestures
+    (GESTURE_*) the angles and tap/omni/shake/lasso fields report.
+    """
+    __slots__ = ("serial", "sequence", "mask", "w_ang", "v_ang", "h_ang", "tap_d", "tap_v", "omni_d", "omni_v",
+                 "shake_d", "shake_v", "shake_du", "lasso_d", "lasso_v")
+
+    def __init__(self, serial, sequence, mask, w_ang, v_ang, h_ang, tap_d, tap_v, omni_d, omni_v,
+                 shake_d, shake_v, shake_du, lasso_d, lasso_v):
+        self.serial = serial
+        self.sequence = sequence
+        self.mask = mask
+        self.w_ang = w_ang
+        self.v_ang = v_ang
+        self.h_ang = h_ang
+        self.tap_d = tap_d
+        self.tap_v = tap_v
+        self.omni_d = omni_d
+        self.omni_v = omni_v
+        self.shake_d = shake_d
+        self.shake_v = shake_v
+        self.shake_du = shake_du
+        self.lasso_d = lasso_d
+        self.lasso_v = lasso_v
+
+    def __repr__(self):
+        return "GestureRecord({:08X}, sequence={}, mask=0x{:02X})".format(self.serial, self.sequence, self.mask)
+
 
 def parse_cdp(data, handler):
-    if len(data) < 20:
-        print("cdp: data too short for header", file=sys.stderr)
+    """Decode a CDP datagram, calling handler(serial, position, user_data) for each record.
+
+    The datagram is walked with an offset cursor and precompiled structs, so only the few
+    bytes of each fixed-size field are ever sliced out; 'user_data' is a memoryview over the
+    rest of the datagram from the user record on.
+    """
+    if len(data) < CDP_HEADER.size:
+        ERRORS("cdp: data too short for header", "{} bytes", len(data))
         return
 
-    mark, seq, version, uid = struct.unpack("<II8sI", data[:20])
+    mark, seq, version, uid = CDP_HEADER.unpack(data[:CDP_HEADER.size])
 
     if mark != CDP_MAGIC:
-        print("cdp: bad mark 0x{:08X} != 0x%08X (expected)", mark, CDP_MAGIC, file=sys.stderr)
+        ERRORS("cdp: bad mark", "0x{:08X} != 0x{:08X} (expected)", mark, CDP_MAGIC)
         return
 
     if version != CDP_VERSN:
-        print("cdp: bad version '{}' != '{}' (expected)", version, CDP_VERSN, file=sys.stderr)
+        ERRORS("cdp: bad version", "{!r} != {!r} (expected)", version, CDP_VERSN)
         return
 
-    data = data[20:]
+    offset = CDP_HEADER.size
+    end = len(data) - CDP_RECORD.size
+    view = None
+    unpack_record = CDP_RECORD.unpack
 
     results = []
 
-    while len(data) >= 4:
-        typ, size = struct.unpack("<HH", data[:4])
+    while offset <= end:
+        typ, size = unpack_record(data[offset:offset + 4])
 
         # print("mark={} seq={} ver={} uid={} typ=0x{:04X} size={}".format(mark, seq, version, uid, typ, size))
 
-        data = data[4:]
+        offset += 4
 
-        if len(data) < size:
-            print("cdp: message specified too small data length {} != {}".format(size, len(data)), file=sys.stderr)
+        if offset + size > len(data):
+            ERRORS("cdp: record overruns datagram", "size {} > {} bytes left", size, len(data) - offset)
             return
 
-        if typ == CDP_T_USER:
-            subtyp = ord(data[0])
+        if typ == CDP_T_USER and offset < len(data):
+            subtyp = ord(data[offset])
             if subtyp == 0x04:
-                result = handler(uid, None, data)
+                if view is None:
+                    view = memoryview(data)
+
+                result = handler(uid, None, view[offset:])
 
                 if result:
                     results.extend(result)
@@ -57,11 +178,11 @@ def parse_cdp(data, handler):
                 # print("cdp: unknown subtype 0x{:02X}".format(subtyp), file=sys.stderr)
 
         elif typ == CDP_T_POS:
-            if len(data) != 24:
-                print("cdp: position message has bad length", file=sys.stderr)
+            if size != 24:
+                ERRORS("cdp: position record has bad length", "{} != 24", size)
                 return
 
-            px, py, pz, quality, smoothing, sequence, network_time = struct.unpack("<iiiIHHI", data)
+            px, py, pz, quality, smoothing, sequence, network_time = CDP_POSITION.unpack(data[offset:offset + 24])
 
             result = handler(uid, (px / 1000.0, py / 1000.0, pz / 1000.0), None)
 
@@ -70,25 +191,243 @@ def parse_cdp(data, handler):
         else:
             pass
 
-        data = data[size:]
+        offset += size
 
     return results
 
 
-def parse_dcc(data, handler):
+def parse_cdp_records(data, handler):
+    """Decode a CDP datagram like parse_cdp(), but call handler(record) once per position
+    (PositionRecord) and gesture (GestureRecord) record, each decoded once here. User records
+    too short to hold a gesture are skipped.
+    """
+    if len(data) < CDP_HEADER.size:
+        ERRORS("cdp: data too short for header", "{} bytes", len(data))
+        return
+
+    mark, seq, version, uid = CDP_HEADER.unpack(data[:CDP_HEADER.size])
+
+    if mark != CDP_MAGIC:
+        ERRORS("cdp: bad mark", "0x{:08X} != 0x{:08X} (expected)", mark, CDP_MAGIC)
+        return
+
+    if version != CDP_VERSN:
+        ERRORS("cdp: bad version", "{!r} != {!r} (expected)", version, CDP_VERSN)
+        return
+
+    offset = CDP_HEADER.size
+    end = len(data) - CDP_RECORD.size
+    unpack_record = CDP_RECORD.unpack
+
+    results = []
+
+    while offset <= end:
+        typ, size = unpack_record(data[offset:offset + 4])
+        offset += 4
+
+        if offset + size > len(data):
+            ERRORS("cdp: record overruns datagram", "size {} > {} bytes left", size, len(data) - offset)
+            return
+
+        if typ == CDP_T_USER:
+            if size > CDP_GESTURE.size and ord(data[offset]) == 0x04:
+                result = handler(GestureRecord(uid, *CDP_GESTURE.unpack(data[offset + 1:offset + 1 + CDP_GESTURE.size])))
+
+                if result:
+                    results.extend(result)
+
+        elif typ == CDP_T_POS:
+            if size != 24:
+                ERRORS("cdp: position record has bad length", "{} != 24", size)
+                return
+
+            px, py, pz, quality, smoothing, sequence, network_time = CDP_POSITION.unpack(data[offset:offset + 24])
+
+            result = handler(PositionRecord(
+                uid, (px / 1000.0, py / 1000.0, pz / 1000.0), quality, smoothing, sequence, network_time
+            ))
+
+            if result:
+                results.extend(result)
+
+        offset += size
+
+    return results
+
+
+def cdp_key(data):
+    """Returns the tag serial of a CDP datagram holding exactly one position record, else None.
+    Datagrams carrying user (gesture) data never get a key, so they are never collapsed.
+    """
+    if len(data) != 48:
+        return None
+
+    mark, uid, typ = struct.unpack_from("<I12xIH", data)
+
+    if mark != CDP_MAGIC or typ != CDP_T_POS:
+        return None
+
+    return uid
+
+
+def cdp_serial(data):
+    """Returns the tag serial of any CDP datagram (position or user data), else None.
+    """
+    if len(data) < 20:
+        return None
+
+    mark, uid = struct.unpack_from("<I12xI", data)
+
+    if mark != CDP_MAGIC:
+        return None
+
+    return uid
+
+
+def cdp_sequence(data):
+    """Returns (serial, datagram sequence number) of any CDP datagram, else None.
+    """
+    if len(data) < 20:
+        return None
+
+    mark, seq, uid = struct.unpack_from("<II8xI", data)
+
+    if mark != CDP_MAGIC:
+        return None
+
+    return uid, seq
+
+
+class RecordFilter(object):
+    """Wraps a parse_cdp_records() handler, passing on only the records whose per-tag
+    sequence number is new: positions repeated by the network and the repeats of a gesture
+    the tag sends for reliability are dropped before the handler runs. The trackers
+    ('positions', 'gestures') count duplicates, gaps and reorders.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.positions = sequence.Tracker("cdp_position", 1 << 16)
+        self.gestures = sequence.Tracker("cdp_gesture", 1 << 8)
+
+    def __call__(self, record):
+        tracker = self.gestures if type(record) is GestureRecord else self.positions
+
+        if tracker.check(record.serial, record.sequence):
+            return self.handler(record)
+
+
+def cdp_position_records(data):
+    """Yields (serial, offset) for every well-formed position record in a CDP datagram.
+    Malformed datagrams yield nothing, silently.
+    """
+    if len(data) < CDP_HEADER.size:
+        return
+
+    mark, seq, version, uid = CDP_HEADER.unpack(data[:CDP_HEADER.size])
+
+    if mark != CDP_MAGIC or version != CDP_VERSN:
+        return
+
+    offset = CDP_HEADER.size
+    end = len(data) - CDP_RECORD.size
+
+    while offset <= end:
+        typ, size = CDP_RECORD.unpack(data[offset:offset + 4])
+        offset += 4
+
+        if offset + size > len(data):
+            return
+
+        if typ == CDP_T_POS and size == 24:
+            yield uid, offset
+
+        offset += size
+
+
+def cdp_positions(datagrams):
+    """Decode every position record in a batch of CDP datagrams (or in one datagram) into a
+    structured numpy array of CDP_POSITION_DTYPE, in arrival order, positions in metres.
+
+    Datagrams holding just one position record, the usual case, are decoded together
+    through a single numpy view of the concatenated batch; the rest are scanned for their
+    position records, which are then decoded together the same way. Malformed datagrams
+    and other records are skipped. Requires numpy.
+    """
+    if numpy is None:
+        raise ImportError("cdp_positions requires numpy")
+
+    if isinstance(datagrams, (str, memoryview)):
+        datagrams = (datagrams,)
+
+    frames = []
+    frame_index = []
+    records = []
+    record_serials = []
+    record_index = []
+
+    for index, data in enumerate(datagrams):
+        if type(data) is memoryview:
+            data = data.tobytes()
+
+        if len(data) == CDP_POSITION_FRAME.itemsize:
+            frames.append(data)
+            frame_index.append(index)
+            continue
+
+        for uid, offset in cdp_position_records(data):
+            records.append(data[offset:offset + 24])
+            record_serials.append(uid)
+            record_index.append(index)
+
+    frames = _frombuffer("".join(frames), CDP_POSITION_FRAME)
+
+    # a datagram of this size with a valid header can only carry a position record here,
+    # so whatever fails the check holds nothing to decode
+    valid = (frames["mark"] == CDP_MAGIC) & (frames["version"] == CDP_VERSN_WORD) & \
+        (frames["type"] == CDP_T_POS) & (frames["size"] == 24)
+
+    frames = frames[valid]
+    raw = numpy.concatenate((frames["position"], _frombuffer("".join(records), CDP_POSITION_RAW)))
+    index = numpy.concatenate((numpy.array(frame_index, dtype=numpy.intp)[valid], numpy.array(record_index, dtype=numpy.intp)))
+    order = numpy.argsort(index, kind="mergesort")
+    raw = raw[order]
+
+    out = numpy.empty(len(raw), CDP_POSITION_DTYPE)
+    out["serial"] = numpy.concatenate((frames["serial"], numpy.array(record_serials, dtype="<u4")))[order]
+
+    for axis in ("x", "y", "z"):
+        out[axis] = raw[axis] / 1000.0
+
+    for field in ("quality", "smoothing", "sequence", "network_time"):
+        out[field] = raw[field]
+
+    return out
+
+
+def _frombuffer(data, dtype):
+    # older numpy refuses to view an empty buffer
+    return numpy.frombuffer(data, dtype) if data else numpy.zeros(0, dtype)
+
+
+def parse_dcc(data, handler, check_crc=False):
     """
     | SYNC_CODE | Msg Type | Msg SRC | Msg DST | Seq Num | Length  |   Data   |   CRC   |
     --------------------------------------------------------------------------------------
     |  3 Bytes  |  1 Byte  | 2 Bytes | 2 Bytes | 2 Bytes | 4 Bytes | variable | 2 Bytes |
+
+    Calls handler(ts, id, (x, y, z)) for each tag location entry. The header is read with a
+    precompiled struct and all entries of a datagram with one struct (cached per entry
+    count), so the payload is never copied. With 'check_crc' set, datagrams whose CRC does
+    not match dcc_crc() are dropped.
     """
-    data_len_exp = len(data) - 16
-    sync_code, msg_type, msg_src, msg_dst, seq_num, data_len, msg_data, crc = \
-        struct.unpack("<3sBHHHI{}sH".format(data_len_exp), data)
+    fields = dcc_header(data, check_crc)
 
-    if data_len != data_len_exp:
-        print("dcc: length mismatch {} != {}".format(data_len, data_len_exp))
+    if fields is None:
         return
 
+    msg_type, count, entries = fields
+
     if msg_type == MSG_UWB_EVT_ANCHOR_LOC_CHANGED:
         id_hi = 0x00010000
         return
@@ -97,14 +436,15 @@ def parse_dcc(data, handler):
     else:
         return
 
-    count = struct.unpack("<B", msg_data[0])[0]
-    msg_data = msg_data[1:]
+    if not count:
+        return []
+
+    values = dcc_entries(count).unpack(entries)
 
     results = []
 
-    while count:
-        ts, idx, px, py, pz = struct.unpack("<IBfff", msg_data[:17])
-        msg_data = msg_data[17:]
+    for i in range(0, len(values), 5):
+        ts, idx, px, py, pz = values[i:i + 5]
 
         if msg_type == MSG_UWB_EVT_TAG_LOC_CHANGED:
             idx += 128
@@ -117,73 +457,244 @@ def parse_dcc(data, handler):
             else:
                 results.append(result)
 
-        count -= 1
-
     return results
 
 
+def dcc_header(data, check_crc=False):
+    """Validate a DCC datagram's framing. Returns (msg_type, entry count, entry bytes), or
+    None (after reporting why) if the datagram is malformed.
+    """
+    if len(data) < DCC_HEADER.size + DCC_CRC.size:
+        ERRORS("dcc: datagram too short", "{} bytes", len(data))
+        return None
+
+    data_len_exp = len(data) - DCC_HEADER.size - DCC_CRC.size
+    sync_code, msg_type, msg_src, msg_dst, seq_num, data_len = DCC_HEADER.unpack(data[:DCC_HEADER.size])
+
+    if data_len != data_len_exp:
+        ERRORS("dcc: length mismatch", "{} != {}", data_len, data_len_exp)
+        return None
+
+    if check_crc:
+        crc = DCC_CRC.unpack(data[-DCC_CRC.size:])[0]
+        computed = dcc_crc(data[:-DCC_CRC.size])
+
+        if crc != computed:
+            ERRORS("dcc: bad crc", "0x{:04X} != 0x{:04X} (computed)", crc, computed)
+            return None
+
+    if not data_len:
+        return msg_type, 0, ""
+
+    count = ord(data[DCC_HEADER.size])
+    start = DCC_HEADER.size + 1
+    end = start + count * DCC_ENTRY_SIZE
+
+    if end > len(data) - DCC_CRC.size:
+        if msg_type in (MSG_UWB_EVT_TAG_LOC_CHANGED, MSG_UWB_EVT_ANCHOR_LOC_CHANGED):
+            ERRORS("dcc: entries do not fit", "{} entries in {} bytes", count, data_len - 1)
+        return None
+
+    return msg_type, count, data[start:end]
+
+
+def dcc_entries(count):
+    """Returns the (cached) struct decoding 'count' consecutive location entries at once.
+    """
+    entries = DCC_ENTRIES.get(count)
+
+    if entries is None:
+        entries = DCC_ENTRIES[count] = struct.Struct("<" + DCC_ENTRY * count)
+
+    return entries
+
+
+def dcc_crc(data):
+    """CRC-16/CCITT-FALSE (poly 0x1021, initial 0xFFFF) of everything before the CRC field.
+    """
+    crc = 0xFFFF
+    table = DCC_CRC_TABLE
+
+    for c in data:
+        crc = ((crc << 8) & 0xFF00) ^ table[(crc >> 8) ^ ord(c)]
+
+    return crc
+
+
+def dcc_positions(datagrams, check_crc=False):
+    """Decode the tag location entries of a batch of DCC datagrams (or of one datagram) into a
+    structured numpy array of DCC_POSITION_DTYPE (ts in seconds, id, x, y, z), in arrival
+    order. Each datagram's entries are viewed in place with np.frombuffer. Datagrams
+    that are malformed or carry anything but tag locations are skipped. Requires numpy.
+    """
+    if numpy is None:
+        raise ImportError("dcc_positions requires numpy")
+
+    if isinstance(datagrams, (str, memoryview)):
+        datagrams = (datagrams,)
+
+    chunks = []
+
+    for data in datagrams:
+        if type(data) is memoryview:
+            data = data.tobytes()
+
+        fields = dcc_header(data, check_crc)
+
+        if fields is not None and fields[0] == MSG_UWB_EVT_TAG_LOC_CHANGED and fields[1]:
+            chunks.append(numpy.frombuffer(fields[2], DCC_ENTRY_RAW))
+
+    raw = numpy.concatenate(chunks) if chunks else numpy.zeros(0, DCC_ENTRY_RAW)
+    out = numpy.empty(len(raw), DCC_POSITION_DTYPE)
+    out["ts"] = raw["ts"] / 1000.0
+    out["id"] = 0x00020000 | (raw["idx"].astype("<u4") + 128)
+
+    for axis in ("x", "y", "z"):
+        out[axis] = raw[axis]
+
+    return out
+
+
 def parse_lcm(data, handler):
-    if len(data) < 8:
-        print("lcm: bad length {}".format(len(data)), file=sys.stderr)
+    """Decode an LCM datagram carrying a Ciholas message, handing it to the decoder registered
+    for its channel (see lcm_channel()). Returns what the decoder returns; datagrams on
+    channels without a decoder are ignored.
+    """
+    if type(data) is memoryview:
+        data = data.tobytes()
+
+    if len(data) < LCM_HEADER.size:
+        ERRORS("lcm: datagram too short", "{} bytes", len(data))
         return None
 
-    lcm_magic, lcm_sequence = struct.unpack(">II", data[:8])
+    lcm_magic, lcm_sequence = LCM_HEADER.unpack(data[:LCM_HEADER.size])
 
     if lcm_magic != LCM_MAGIC:
-        print("lcm: bad magic 0x{:08X} != 0x{:08X}".format(lcm_magic, LCM_MAGIC), file=sys.stderr)
+        ERRORS("lcm: bad magic", "0x{:08X} != 0x{:08X}", lcm_magic, LCM_MAGIC)
         return None
 
-    channel_name = ''
-    data = data[8:]
-    index = 0
-
-    if len(data) < 3:
-        print("lcm: message too short (parse channel name)", file=sys.stderr)
+    if len(data) < LCM_HEADER.size + 3:
+        ERRORS("lcm: no channel name", "{} bytes", len(data))
         return None
 
-    while data[index] != '\x00':
-        channel_name += data[index]
-        index += 1
-        if index >= len(data):
-            print("lcm: could not parse channel name", file=sys.stderr)
-            return None
+    end = data.find("\0", LCM_HEADER.size)
+
+    if end < 0:
+        ERRORS("lcm: no channel name", "unterminated")
+        return None
 
-    data = data[index+1:]
+    offset = end + 1
 
-    if len(data) < 4:
-        print("lcm: message too short (parse ciholas magic)", file=sys.stderr)
+    if len(data) < offset + CIH_HEADER.size:
+        ERRORS("lcm: no ciholas magic", "{} bytes", len(data))
         return None
 
-    magic_cih = struct.unpack(">I", data[:4])[0]
+    magic_cih = CIH_HEADER.unpack(data[offset:offset + CIH_HEADER.size])[0]
 
     if magic_cih != CIH_MAGIC:
-        print("lcm: bad ciholas magic 0x{:08X} != 0x{:08X}".format(magic_cih, CIH_MAGIC), file=sys.stderr)
+        ERRORS("lcm: bad ciholas magic", "0x{:08X} != 0x{:08X}", magic_cih, CIH_MAGIC)
         return None
 
-    data = data[4:]
+    decoder = LCM_CHANNELS.get(data[LCM_HEADER.size:end])
 
-    if channel_name == 'P3':
-        if len(data) < 35:
-            print("lcm: P3 message too short", file=sys.stderr)
-            return None
+    if decoder is None:
+        return None
 
-        payload_size, dwusb_serial, network_id, px, py, pz, quality, smoothing, timestamp, size = struct.unpack(
-           ">HIHffffBQH", data[:35]
-        )
+    return decoder(data, offset + CIH_HEADER.size, handler)
 
-        # payload_size == len(data[2:-4])
-        # data[:-4] == LCM_FOOTR
-        # size == len(user_data)
 
-        user_data = data[35:-4]
+def lcm_channel(name):
+    """Decorator registering decoder(data, offset, handler) for the LCM channel 'name'.
+    'offset' is where the message starts in 'data', right after the Ciholas magic.
+    """
+    def register(decoder):
+        LCM_CHANNELS[name] = decoder
+        return decoder
 
-        if len(user_data) != size:
-            print("lcm: invalid P3 message length {} != {}".format(size, len(user_data) - 4), file=sys.stderr)
-            return None
+    return register
 
-        user_data = user_data[:-4]
 
-        return handler(dwusb_serial, (px, py, pz), user_data)
+@lcm_channel("P3")
+def lcm_p3(data, offset, handler):
+    """Ciholas P3 position: calls handler(serial, (x, y, z), user_data).
+    """
+    if len(data) - offset < LCM_P3.size:
+        ERRORS("lcm: P3 message too short", "{} bytes", len(data) - offset)
+        return None
 
-    else:
+    payload_size, dwusb_serial, network_id, px, py, pz, quality, smoothing, timestamp, size = LCM_P3.unpack(
+        data[offset:offset + LCM_P3.size]
+    )
+
+    # payload_size == len(data[2:-4])
+    # data[:-4] == LCM_FOOTR
+    # size == len(user_data)
+
+    start = offset + LCM_P3.size
+    user_size = max(0, len(data) - start - 4)
+
+    if user_size != size:
+        ERRORS("lcm: P3 user data length mismatch", "{} != {}", size, user_size)
         return None
+
+    return handler(dwusb_serial, (px, py, pz), data[start:max(start, len(data) - 8)])
+
+
+# The pure-Python decoders stay reachable under these names when the compiled ones take over.
+python_parse_cdp = parse_cdp
+python_parse_cdp_records = parse_cdp_records
+python_parse_dcc = parse_dcc
+python_parse_lcm = parse_lcm
+
+try:
+    import _parse
+except ImportError:
+    _parse = None
+
+if _parse is not None:
+    # see _parse.c: well-formed datagrams are decoded in C, everything else by the functions above
+    _parse.set_fallbacks(python_parse_cdp, python_parse_dcc, python_parse_lcm, LCM_CHANNELS, lcm_p3)
+    _parse.set_records(python_parse_cdp_records, PositionRecord, GestureRecord)
+    parse_cdp = _parse.parse_cdp
+    parse_cdp_records = _parse.parse_cdp_records
+    parse_dcc = _parse.parse_dcc
+    parse_lcm = _parse.parse_lcm
+
+
+def dcc_match(data):
+    """DCC has no magic: a datagram is taken for DCC if its length field accounts for it.
+    """
+    return DCC_HEADER.unpack(data[:DCC_HEADER.size])[5] == len(data) - DCC_HEADER.size - DCC_CRC.size
+
+
+# Protocol descriptions for protocol.detect() / protocol.parse(). The decoders above are
+# hand-tuned implementations of them (compiled when _parse is built) and are used instead of
+# the generic ones.
+CDP_PROTOCOL = protocol.register(protocol.Protocol(
+    "cdp", CDP_HEADER.format, ("mark", "sequence", "version", "serial"),
+    magic={"mark": CDP_MAGIC, "version": CDP_VERSN},
+    serial="serial",
+    record_header=CDP_RECORD.format,
+    records={
+        CDP_T_POS: protocol.Record(
+            "position", CDP_POSITION.format, (("position", 3), "quality", "smoothing", "sequence", "network_time"),
+            scale={"position": 1000}, cls=PositionRecord, exact=True
+        ),
+        CDP_T_USER: protocol.Record(
+            "gesture", CDP_GESTURE.format, GestureRecord.__slots__[1:], prefix="\x04", cls=GestureRecord
+        ),
+    },
+    decoder=parse_cdp_records
+))
+
+LCM_PROTOCOL = protocol.register(protocol.Protocol(
+    "lcm", LCM_HEADER.format, ("magic", "sequence"),
+    magic={"magic": LCM_MAGIC},
+    decoder=parse_lcm
+))
+
+DCC_PROTOCOL = protocol.register(protocol.Protocol(
+    "dcc", DCC_HEADER.format, ("sync", "type", "source", "destination", "sequence", "length"),
+    match=dcc_match,
+    decoder=parse_dcc
+))
@@ -173,11 +173,7 @@ def median(arr):
 
 
 def osc_position(serial, position):
-    return osc_message("/{}/position".format(serial), *position)
-
-
-def osc_message(path, *data):
-    return OSC.OSCMessage(path, data).getBinary()
+    return OSC.MessageTemplate.get("/{}/position".format(serial), "fff").pack(*position)
 
 
 def display_position(serial, position, data):
@@ -214,12 +210,15 @@ def main(args):
     else:
         position_handler = handle_position
 
-    fwd = forward.Forward(
-        args.input, args.port, args.out, args.out_port,
+    fwd = forward.create(
+        args, args.input, args.port, args.out, args.out_port,
         iface=args.iface,
         iface_out=args.out_iface,
         verbose=False,
-        handler=lambda data: handler(data, position_handler)
+        handler=lambda data: handler(data, position_handler),
+        key=parse.cdp_key,
+        shard_key=parse.cdp_serial,
+        seq_key=parse.cdp_sequence
     )
 
     cleanup.install(lambda: os._exit(0))
@@ -240,9 +239,11 @@ if __name__ == '__main__':
     parser.add_argument('-P', '--out-port', metavar='PORT', type=int, help='destination port')
     parser.add_argument('-v', '--verbose', action='store_true', help='verbose output')
     parser.add_argument('-D', '--debug', action='store_true', help='debug mode')
+    forward.add_arguments(parser)
 
     try:
         params = parser.parse_args()
+        forward.check_arguments(parser, params)
         main(params)
 
     except KeyboardInterrupt:
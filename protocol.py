@@ -0,0 +1,280 @@
+"""Declarative descriptions of binary UWB tracking protocols.
+
+A Protocol is described once: its header layout, the header fields identifying it (its
+magic), and a table of the records it carries with their field layouts and scale factors.
+The description is compiled into a Struct-based decoder, and register() adds it to the
+protocols detect() and parse() pick from by magic.
+"""
+from __future__ import print_function
+import re
+import struct
+import errors
+
+PROTOCOLS = []  # registered protocols, in detection order
+
+ERRORS = errors.ErrorLog("protocol")  # malformed datagrams seen by generated decoders
+
+FORMAT_ITEM = re.compile(r"(\d*)([xcbB?hHiIlLqQfdspP])")
+
+
+def format_items(fmt):
+    """Split a struct format into (count, code) items, without the byte order character.
+    """
+    if fmt[:1] in "@=<>!":
+        fmt = fmt[1:]
+
+    return [(int(count or 1), code) for count, code in FORMAT_ITEM.findall(fmt)]
+
+
+def field_offsets(fmt):
+    """Byte offset and format of each value a struct format unpacks to.
+    """
+    order = fmt[0] if fmt[:1] in "@=<>!" else "@"
+    offsets = []
+    layout = order
+
+    for count, code in format_items(fmt):
+        if code in "sp":
+            offsets.append((struct.calcsize(layout), order + str(count) + code))
+        elif code != "x":
+            for _ in range(count):
+                offsets.append((struct.calcsize(layout), order + code))
+                layout += code
+            continue
+
+        layout += str(count) + code
+
+    return offsets
+
+
+def record_class(name, fields):
+    """A __slots__ class holding a serial and 'fields', constructed as cls(serial, *fields).
+    """
+    names = ("serial",) + tuple(fields)
+    source = "def __init__(self, {}):\n{}".format(
+        ", ".join(names), "".join("    self.{0} = {0}\n".format(field) for field in names)
+    )
+    namespace = {}
+    exec source in namespace
+
+    def __repr__(self):
+        return "{}({})".format(name, ", ".join("{}={!r}".format(field, getattr(self, field)) for field in names))
+
+    return type(name, (object,), {"__slots__": names, "__init__": namespace["__init__"], "__repr__": __repr__})
+
+
+class Record(object):
+    """One record type: the struct 'layout' of its payload (after the constant 'prefix'
+    bytes) and the names of the fields it decodes to. A field given as (name, count) gathers
+    'count' consecutive values into a tuple; 'scale' maps field names to divisors applied to
+    their raw values.
+
+    Decoded records are instances of 'cls', built as cls(serial, *fields); a __slots__
+    class is made up from the field names when 'cls' is not given. With 'exact' set, a
+    record of any other size invalidates the datagram; otherwise larger records are
+    accepted and records too short for the layout are skipped.
+    """
+
+    def __init__(self, name, layout, fields, scale=None, prefix="", cls=None, exact=False):
+        self.name = name
+        self.struct = struct.Struct(layout)
+        self.fields = tuple(field if isinstance(field, basestring) else field[0] for field in fields)
+        self.prefix = prefix
+        self.size = len(prefix) + self.struct.size
+        self.exact = exact
+        self.cls = cls or record_class(name, self.fields)
+        self.arguments = self.compile(fields, scale or {})
+
+    def compile(self, fields, scale):
+        """The source of the constructor arguments after the serial, from the unpacked values 'v'.
+        """
+        args = []
+        index = 0
+
+        for field in fields:
+            name, count = (field, None) if isinstance(field, basestring) else field
+            values = []
+
+            for i in range(index, index + (count or 1)):
+                values.append("v[{}] / {!r}".format(i, float(scale[name])) if name in scale else "v[{}]".format(i))
+
+            index += count or 1
+            args.append(values[0] if count is None else "({},)".format(", ".join(values)))
+
+        if index != len(field_offsets(self.struct.format)):
+            raise ValueError("{}: fields do not match layout {!r}".format(self.name, self.struct.format))
+
+        return ", ".join(args)
+
+
+class Protocol(object):
+    """A datagram protocol: a 'header' struct layout with field names, the 'magic' header
+    field values identifying it, the header field holding the tag 'serial', and a
+    type-length framed sequence of 'records' (a dict of record type -> Record) following the
+    header, each introduced by a 'record_header' struct of (type, size).
+
+    compile() generates decode(data, handler), calling handler(record) for each known record.
+    A hand-written implementation of the same description can be given as 'decoder'; it is
+    used instead. Protocols without a magic can identify their datagrams with 'match'.
+    """
+
+    def __init__(self, name, header, fields, magic=None, serial=None, record_header=None, records=None,
+                 decoder=None, match=None):
+        self.name = name
+        self.header = struct.Struct(header)
+        self.fields = tuple(fields)
+        self.magic = magic or {}
+        self.serial = serial
+        self.record_header = struct.Struct(record_header) if record_header else None
+        self.records = records or {}
+        self.match = match
+
+        if len(self.fields) != len(field_offsets(header)):
+            raise ValueError("{}: fields do not match header {!r}".format(name, header))
+
+        self.source = None  # of the generated decoder
+        self.signature = self.compile_magic()
+        self.compiled = self.compile() if self.record_header else None
+        self.decode = decoder or self.compiled
+
+    def __repr__(self):
+        return "Protocol({!r})".format(self.name)
+
+    def compile_magic(self):
+        """The (offset, bytes) pairs a datagram of this protocol carries.
+        """
+        offsets = field_offsets(self.header.format)
+        signature = []
+
+        for field, value in self.magic.items():
+            offset, fmt = offsets[self.fields.index(field)]
+            signature.append((offset, struct.pack(fmt, value)))
+
+        return sorted(signature)
+
+    def matches(self, data):
+        if len(data) < self.header.size:
+            return False
+
+        for offset, value in self.signature:
+            if data[offset:offset + len(value)] != value:
+                return False
+
+        if self.match is not None:
+            return self.match(data)
+
+        return bool(self.signature)
+
+    def compile(self):
+        """Generate decode(data, handler): the header and magic checks, then one branch per
+        record type unpacking its payload with its own struct, straight into its class.
+        """
+        namespace = {
+            "error": ERRORS,
+            "unpack_header": self.header.unpack, "unpack_record": self.record_header.unpack
+        }
+        magic = " or ".join(
+            "data[{}:{}] != {!r}".format(offset, offset + len(value), value) for offset, value in self.signature
+        )
+        lines = [
+            "def decode(data, handler):",
+            "    if len(data) < {}:".format(self.header.size),
+            "        error({!r}, '{{}} bytes', len(data))".format(self.name + ": data too short for header"),
+            "        return",
+        ]
+
+        if magic:
+            lines += [
+                "    if {}:".format(magic),
+                "        error({!r})".format(self.name + ": bad magic"),
+                "        return",
+            ]
+
+        if self.serial:
+            lines.append("    serial = unpack_header(data[:{}])[{}]".format(self.header.size, self.fields.index(self.serial)))
+        else:
+            lines.append("    serial = None")
+
+        size = self.record_header.size
+        lines += [
+            "    offset = {}".format(self.header.size),
+            "    end = len(data) - {}".format(size),
+            "    results = []",
+            "    while offset <= end:",
+            "        typ, size = unpack_record(data[offset:offset + {}])".format(size),
+            "        offset += {}".format(size),
+            "        if offset + size > len(data):",
+            "            error({!r}, 'size {{}} > {{}} bytes left', size, len(data) - offset)".format(
+                self.name + ": record overruns datagram"),
+            "            return",
+        ]
+
+        for index, (typ, record) in enumerate(sorted(self.records.items())):
+            namespace["unpack_{}".format(index)] = record.struct.unpack
+            namespace["cls_{}".format(index)] = record.cls
+            start = len(record.prefix)
+            lines.append("        {} typ == {}:".format("if" if not index else "elif", typ))
+
+            if record.exact:
+                lines += [
+                    "            if size != {}:".format(record.size),
+                    "                error({!r}, '{{}} != {}', size)".format(
+                        "{}: {} record has bad length".format(self.name, record.name), record.size),
+                    "                return",
+                ]
+
+            conditions = [] if record.exact else ["size >= {}".format(record.size)]
+
+            if record.prefix:
+                conditions.append("data[offset:offset + {}] == {!r}".format(start, record.prefix))
+
+            indent = "            "
+
+            if conditions:
+                lines.append(indent + "if {}:".format(" and ".join(conditions)))
+                indent += "    "
+
+            lines += [
+                indent + "v = unpack_{}(data[offset + {}:offset + {}])".format(index, start, record.size),
+                indent + "result = handler(cls_{}(serial, {}))".format(index, record.arguments),
+                indent + "if result:",
+                indent + "    results.extend(result)",
+            ]
+
+        lines += [
+            "        offset += size",
+            "    return results",
+        ]
+
+        self.source = "\n".join(lines) + "\n"
+        exec self.source in namespace
+        return namespace["decode"]
+
+
+def register(protocol):
+    """Add 'protocol' to those detect() tries, after the ones registered before it.
+    """
+    PROTOCOLS.append(protocol)
+    return protocol
+
+
+def detect(data):
+    """Returns the registered protocol 'data' belongs to, or None.
+    """
+    for protocol in PROTOCOLS:
+        if protocol.matches(data):
+            return protocol
+
+    return None
+
+
+def parse(data, handler):
+    """Decode a datagram of any registered protocol. The handler is called as that protocol's
+    decoder calls it; returns None for datagrams of no known protocol.
+    """
+    protocol = detect(data)
+
+    if protocol is None:
+        return None
+
+    return protocol.decode(data, handler)
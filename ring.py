@@ -0,0 +1,331 @@
+"""Bounded single-producer/single-consumer ring buffer.
+
+Slots are preallocated and addressed through monotonically increasing head/tail
+counters, so push and pop are O(1) and never move other items. Only the producer
+writes the tail and only the consumer writes the head, which keeps the fast path
+free of locks (the interpreter lock makes each counter update atomic). The two
+events are only used to park a thread when the ring is empty or full.
+
+ShmRing applies the same scheme to byte records in shared memory, between a
+producer and a consumer process.
+"""
+import os
+import ctypes
+import errno
+import fcntl
+import mmap
+import select
+import struct
+import threading
+
+
+class Ring(object):
+    capacity = 0
+    slots = None
+    head = 0
+    tail = 0
+    high_water = 0
+    pushed = 0
+    popped = 0
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("ring capacity must be positive")
+
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.readable = threading.Event()
+        self.writable = threading.Event()
+        self.writable.set()
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def __str__(self):
+        return "{}/{} (hwm {})".format(len(self), self.capacity, self.high_water)
+
+    def full(self):
+        return self.tail - self.head >= self.capacity
+
+    def push(self, item):
+        """Store an item at the tail. Returns False (and drops nothing) if the ring is full.
+        """
+        tail = self.tail
+        depth = tail - self.head
+
+        if depth >= self.capacity:
+            self.writable.clear()
+            return False
+
+        self.slots[tail % self.capacity] = item
+        self.tail = tail + 1
+        self.pushed += 1
+
+        if depth >= self.high_water:
+            self.high_water = depth + 1
+
+        self.readable.set()
+        return True
+
+    def pop(self):
+        """Remove and return the item at the head, or None if the ring is empty.
+        """
+        head = self.head
+
+        if head == self.tail:
+            self.readable.clear()
+            return None
+
+        index = head % self.capacity
+        item = self.slots[index]
+        self.slots[index] = None
+        self.head = head + 1
+        self.popped += 1
+        self.writable.set()
+        return item
+
+    def drain(self, limit=None):
+        """Remove and return up to 'limit' items (all queued items by default) as a list.
+        """
+        head = self.head
+        count = self.tail - head
+
+        if limit is not None and count > limit:
+            count = limit
+
+        if count <= 0:
+            self.readable.clear()
+            return []
+
+        capacity = self.capacity
+        slots = self.slots
+        start = head % capacity
+        end = start + count
+
+        if end <= capacity:
+            items = slots[start:end]
+            slots[start:end] = [None] * count
+        else:
+            end -= capacity
+            items = slots[start:] + slots[:end]
+            slots[start:] = [None] * (capacity - start)
+            slots[:end] = [None] * end
+
+        self.head = head + count
+        self.popped += count
+        self.writable.set()
+        return items
+
+    def wait_readable(self, timeout=None):
+        """Block the consumer until at least one item is queued. Returns False on timeout.
+        """
+        while self.tail == self.head:
+            self.readable.clear()
+
+            # re-check after clearing so a push racing with clear() is never missed
+            if self.tail != self.head:
+                break
+
+            if not self.readable.wait(timeout) and timeout is not None:
+                return self.tail != self.head
+
+        return True
+
+    def wait_writable(self, timeout=None):
+        """Block the producer until a slot is free. Returns False on timeout.
+        """
+        while self.tail - self.head >= self.capacity:
+            self.writable.clear()
+
+            if self.tail - self.head < self.capacity:
+                break
+
+            if not self.writable.wait(timeout) and timeout is not None:
+                return self.tail - self.head < self.capacity
+
+        return True
+
+    def reset_high_water(self):
+        self.high_water = len(self)
+
+
+class ShmRing(object):
+    """Bounded single-producer/single-consumer ring of byte strings shared across processes.
+
+    Records live in an anonymous shared mapping, so the ring must be created before
+    fork()ing the process on the other end. Each record is a 4-byte length followed by
+    the payload, padded to 4 bytes; a record that does not fit before the end of the
+    mapping is preceded by a wrap marker and written from the start. The head, tail and
+    a 'sleeping' flag live in the mapping's header.
+
+    A consumer with nothing to do parks on a pipe (see park()), which the producer only
+    writes to while the consumer is asleep. The pipe's read end is exposed by fileno() so
+    one thread can wait on several rings with select/epoll.
+    """
+    HEADER = ctypes.c_uint64 * 3  # head, tail, sleeping
+    LENGTH = struct.Struct("=I")
+    WRAP = 0xFFFFFFFF
+
+    # lost wakeups are possible in theory (no memory barrier between the flag and the
+    # tail), so a parked consumer never sleeps longer than this before re-checking
+    PARK_MAX = 0.01
+
+    size = 0
+    high_water = 0
+    pushed = 0
+    popped = 0
+
+    def __init__(self, size):
+        if size < 64 or size % 4:
+            raise ValueError("ring size must be a multiple of 4 and at least 64 bytes")
+
+        self.size = size
+        self.buf = mmap.mmap(-1, ctypes.sizeof(ShmRing.HEADER) + size)
+        # the counters go through ctypes rather than struct.pack_into, which clears a field
+        # before writing it; the other process must never see a half-written counter
+        self.header = ShmRing.HEADER.from_buffer(self.buf)
+        self.rfd, self.wfd = os.pipe()
+
+        for fd in (self.rfd, self.wfd):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def __len__(self):
+        """Queued bytes (including record headers and padding).
+        """
+        return self.header[1] - self.header[0]
+
+    def __str__(self):
+        return "{}/{} bytes (hwm {})".format(len(self), self.size, self.high_water)
+
+    def fileno(self):
+        return self.rfd
+
+    def push(self, data):
+        """Append a record. Returns False (and drops nothing) if the ring lacks room for it.
+        """
+        buf = self.buf
+        header = self.header
+        size = self.size
+        base = ctypes.sizeof(ShmRing.HEADER)
+        head = header[0]
+        tail = header[1]
+        need = (ShmRing.LENGTH.size + len(data) + 3) & ~3
+        position = tail % size
+        skip = size - position if position + need > size else 0
+
+        if tail + skip + need - head > size:
+            return False
+
+        if skip:
+            ShmRing.LENGTH.pack_into(buf, base + position, ShmRing.WRAP)
+            position = 0
+
+        ShmRing.LENGTH.pack_into(buf, base + position, len(data))
+        start = base + position + ShmRing.LENGTH.size
+        buf[start:start + len(data)] = data
+
+        # publish the payload before the tail that makes it visible
+        tail += skip + need
+        header[1] = tail
+        self.pushed += 1
+
+        if tail - head > self.high_water:
+            self.high_water = tail - head
+
+        if header[2]:
+            self._ring()
+
+        return True
+
+    def pop(self):
+        """Remove and return the record at the head, or None if the ring is empty.
+        """
+        buf = self.buf
+        header = self.header
+        size = self.size
+        base = ctypes.sizeof(ShmRing.HEADER)
+        head = header[0]
+
+        if head == header[1]:
+            return None
+
+        position = head % size
+        length = ShmRing.LENGTH.unpack_from(buf, base + position)[0]
+
+        if length == ShmRing.WRAP:
+            head += size - position
+            position = 0
+            length = ShmRing.LENGTH.unpack_from(buf, base + position)[0]
+
+        start = base + position + ShmRing.LENGTH.size
+        data = buf[start:start + length]
+        header[0] = head + ((ShmRing.LENGTH.size + length + 3) & ~3)
+        self.popped += 1
+        return data
+
+    def drain(self, limit=None):
+        """Remove and return up to 'limit' records (all queued records by default) as a list.
+        """
+        items = []
+
+        while limit is None or len(items) < limit:
+            data = self.pop()
+
+            if data is None:
+                break
+
+            items.append(data)
+
+        return items
+
+    def park(self):
+        """Announce that the consumer is about to sleep on fileno().
+        Returns False (and stays awake) if records arrived in the meantime.
+        """
+        header = self.header
+        header[2] = 1
+
+        if header[0] != header[1]:
+            self.unpark()
+            return False
+
+        return True
+
+    def unpark(self):
+        self.header[2] = 0
+
+        try:
+            while os.read(self.rfd, 4096):
+                pass
+
+        except OSError as exc:
+            if exc.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def wait_readable(self, timeout=None):
+        """Block the consumer until a record is queued. Returns False if none arrived within
+        'timeout' or PARK_MAX seconds, whichever is shorter.
+        """
+        if self.park():
+            if timeout is None or timeout > ShmRing.PARK_MAX:
+                timeout = ShmRing.PARK_MAX
+
+            try:
+                select.select([self.rfd], [], [], timeout)
+
+            except select.error as exc:
+                if exc.args[0] != errno.EINTR:
+                    raise
+
+            self.unpark()
+
+        return self.header[0] != self.header[1]
+
+    def _ring(self):
+        try:
+            os.write(self.wfd, "\0")
+
+        except OSError as exc:
+            # a full pipe already guarantees a wakeup
+            if exc.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
@@ -0,0 +1,141 @@
+"""Sequence number tracking: duplicate, gap and reorder detection per source.
+"""
+import ctypes
+import mmap
+
+FIELDS = ("received", "duplicates", "gaps", "reorders", "resets")
+RECEIVED, DUPLICATES, GAPS, REORDERS, RESETS = range(len(FIELDS))
+
+# Counters live in shared memory, one row per process, so the workers of a ShardForward
+# count into the same trackers as the front process; each process sets 'slot' to its row.
+SLOTS = 64
+slot = 0
+
+TRACKERS = []  # every Tracker created, for reporting (see stats.Stats)
+
+
+class Tracker(object):
+    """Tracks the sequence numbers seen per source key, modulo 'modulus'.
+
+    check() accepts a number once: repeats within the last 'window' numbers are
+    duplicates. A number skipping ahead counts the ones skipped as gaps, and one arriving
+    behind the newest (but within the window and not seen yet) counts as a reorder, so
+    gaps - reorders is the count still missing.
+
+    A source that restarts (e.g. a tag power cycled) counts up again through numbers seen
+    already. That is taken for a restart when a seen 0 arrives, when RESTART_RUN seen
+    numbers in a row count up by one, or when a number is further behind than the window:
+    the number is accepted, counted as a reset, and tracking starts afresh from it.
+
+    Counts are kept locally and published to the shared row as soon as anything but a
+    plain in-order number is seen, and otherwise every PUBLISH_EVERY numbers.
+    """
+    WINDOW = 32  # at most 32, so the window bits stay a machine int
+    PUBLISH_EVERY = 64
+    RESTART_RUN = 3
+
+    name = None
+    modulus = 0
+    window = WINDOW
+
+    def __init__(self, name, modulus=1 << 32, window=WINDOW):
+        if not 0 < window <= min(Tracker.WINDOW, modulus // 4):
+            raise ValueError("window must be between 1 and {} and under a quarter of the sequence space".format(
+                Tracker.WINDOW))
+
+        self.name = name
+        self.modulus = modulus
+        self.half = modulus // 2
+        self.window = window
+        self.mask = (1 << window) - 1
+        self.state = {}
+        self.local = [0] * len(FIELDS)
+        self.buf = mmap.mmap(-1, SLOTS * len(FIELDS) * ctypes.sizeof(ctypes.c_uint64))
+        self.counts = (ctypes.c_uint64 * (SLOTS * len(FIELDS))).from_buffer(self.buf)
+        TRACKERS.append(self)
+
+    def __repr__(self):
+        return "Tracker({!r})".format(self.name)
+
+    def check(self, key, seq):
+        """Returns True if 'seq' is new for 'key', False for a duplicate.
+        """
+        local = self.local
+        local[RECEIVED] += 1
+        state = self.state.get(key)
+
+        if state is None:
+            self.state[key] = [seq, 1, 0, 0]  # newest, window bits, run of seen numbers, next in run
+            self.publish()
+            return True
+
+        newest, seen = state[0], state[1]
+        ahead = (seq - newest) % self.modulus
+
+        if ahead == 1:
+            state[0] = seq
+            state[1] = ((seen << 1) | 1) & self.mask
+
+            if not local[RECEIVED] % Tracker.PUBLISH_EVERY:
+                self.publish()
+            return True
+
+        if ahead == 0:
+            local[DUPLICATES] += 1
+            self.publish()
+            return False
+
+        if ahead < self.half:
+            local[GAPS] += ahead - 1
+            state[0] = seq
+            state[1] = ((seen << ahead) | 1) & self.mask if ahead < self.window else 1
+            self.publish()
+            return True
+
+        behind = self.modulus - ahead
+
+        if behind < self.window:
+            bit = 1 << behind
+
+            if not seen & bit:
+                state[1] = seen | bit
+                local[REORDERS] += 1
+                self.publish()
+                return True
+
+            state[2] = state[2] + 1 if seq == state[3] else 1
+            state[3] = (seq + 1) % self.modulus
+
+            if seq and state[2] < Tracker.RESTART_RUN:
+                local[DUPLICATES] += 1
+                self.publish()
+                return False
+
+        local[RESETS] += 1
+        state[:] = seq, 1, 0, 0
+        self.publish()
+        return True
+
+    def publish(self):
+        """Copy this process's counts to its row of the shared counters.
+        """
+        counts = self.counts
+        base = slot * len(FIELDS)
+
+        for i, count in enumerate(self.local):
+            counts[base + i] = count
+
+    def totals(self):
+        """Returns the counters summed over all processes, by field name.
+        """
+        self.publish()
+        counts = self.counts
+        width = len(FIELDS)
+        return dict((field, int(sum(counts[row * width + i] for row in range(SLOTS)))) for i, field in enumerate(FIELDS))
+
+
+def publish():
+    """Publish every tracker's counts, e.g. before a worker process goes idle.
+    """
+    for tracker in TRACKERS:
+        tracker.publish()
@@ -0,0 +1,220 @@
+"""Forwarding pipeline instrumentation: latency histograms, counters and periodic reporting.
+"""
+from __future__ import print_function
+import sys
+import time
+import threading
+import traceback
+import socket
+import OSC
+import sequence
+
+STAGES = ("queue", "process", "send", "total")
+
+
+class Histogram(object):
+    """Log-linear latency histogram in the spirit of HdrHistogram.
+
+    Values are recorded in seconds and binned in microseconds. Below 2**SUB_BITS us the
+    buckets are 1 us wide; above that every power of two is split into 2**(SUB_BITS-1)
+    buckets, so the relative error stays under 2**-(SUB_BITS-1) at any magnitude.
+    """
+    SUB_BITS = 5
+    MAX_EXP = 32
+
+    counts = None
+    count = 0
+    total = 0.0
+    max = 0.0
+
+    def __init__(self):
+        self.counts = [0] * ((1 << Histogram.SUB_BITS) + Histogram.MAX_EXP * (1 << (Histogram.SUB_BITS - 1)))
+
+    def record(self, value):
+        self.count += 1
+        self.total += value
+
+        if value > self.max:
+            self.max = value
+
+        self.counts[Histogram.index(int(value * 1e6))] += 1
+
+    @staticmethod
+    def index(usec):
+        sub = Histogram.SUB_BITS
+
+        if usec < (1 << sub):
+            return usec if usec > 0 else 0
+
+        exp = usec.bit_length() - sub
+
+        if exp > Histogram.MAX_EXP:
+            exp = Histogram.MAX_EXP
+            usec = ((1 << sub) - 1) << exp
+
+        return (1 << sub) + ((exp - 1) << (sub - 1)) + (usec >> exp) - (1 << (sub - 1))
+
+    @staticmethod
+    def value(index):
+        """Upper bound (in seconds) of the values binned into 'index'.
+        """
+        sub = Histogram.SUB_BITS
+
+        if index < (1 << sub):
+            return index / 1e6
+
+        index -= 1 << sub
+        exp = (index >> (sub - 1)) + 1
+        mantissa = (index & ((1 << (sub - 1)) - 1)) + (1 << (sub - 1))
+        return (((mantissa + 1) << exp) - 1) / 1e6
+
+    def percentile(self, pct):
+        if not self.count:
+            return 0.0
+
+        wanted = self.count * pct / 100.0
+        seen = 0
+
+        for index, count in enumerate(self.counts):
+            seen += count
+
+            if count and seen >= wanted:
+                return min(Histogram.value(index), self.max)
+
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class Stats(object):
+    """Counters and per-stage histograms for one Forward.
+
+    The pipeline records into the live histograms; snapshot() swaps in fresh ones so each
+    report covers one interval. The counts of every sequence.Tracker are reported along
+    with the counters, as '<tracker>_<field>'.
+    """
+    hist = None
+    started = 0.0
+    last = 0.0
+
+    def __init__(self):
+        self.hist = dict((stage, Histogram()) for stage in STAGES)
+        self.counters = dict(packets_in=0, messages_out=0, errors=0)
+        self.prev = dict(self.counters)
+        self.started = self.last = time.time()
+
+    def snapshot(self):
+        """Returns (seconds, counter deltas, counter totals, histograms) since the previous snapshot.
+        """
+        hist, self.hist = self.hist, dict((stage, Histogram()) for stage in STAGES)
+        now = time.time()
+        elapsed, self.last = now - self.last, now
+        totals = dict(self.counters)
+
+        for tracker in sequence.TRACKERS:
+            for field, count in tracker.totals().items():
+                totals["{}_{}".format(tracker.name, field)] = count
+
+        deltas = dict((name, totals[name] - self.prev.get(name, 0)) for name in totals)
+        self.prev = totals
+        return elapsed, deltas, totals, hist
+
+
+class Reporter(object):
+    """Periodically dumps a Forward's stats to stderr and/or sends them as an OSC bundle.
+    """
+    ADDRESS = "/forward/stats"
+
+    fwd = None
+    interval = 1.0
+    dest = None
+    thread = None
+
+    def __init__(self, fwd, interval=1.0, dest=None, quiet=False):
+        self.fwd = fwd
+        self.interval = interval
+        self.dest = dest
+        self.quiet = quiet
+        self.thread = threading.Thread(target=self._task)
+        self.thread.daemon = True
+
+        if dest is not None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+
+    def start(self):
+        self.thread.start()
+
+    def _task(self):
+        while 1:
+            time.sleep(self.interval)
+
+            try:
+                report = self.collect()
+
+                if not self.quiet:
+                    print(self.format(report), file=sys.stderr)
+
+                if self.dest is not None:
+                    self.sock.sendto(self.encode(report), self.dest)
+
+            except:
+                traceback.print_exc()
+
+    def collect(self):
+        fwd = self.fwd
+        elapsed, deltas, totals, hist = fwd.stats.snapshot()
+        elapsed = elapsed or 1e-9
+
+        return dict(
+            rates=dict((name, deltas[name] / elapsed) for name in deltas),
+            totals=totals,
+            depth=len(fwd.queue) if fwd.queue is not None else 0,
+            high_water=fwd.queue.high_water if fwd.queue is not None else 0,
+            shed=sum(fwd.shed.values()),
+            latency=dict((stage, (h.count, h.percentile(50), h.percentile(99), h.max)) for stage, h in hist.items()),
+            trackers=[tracker.name for tracker in sequence.TRACKERS]
+        )
+
+    @staticmethod
+    def format(report):
+        rates = report["rates"]
+        line = "fwd: in {:.0f}/s out {:.0f}/s err {} shed {} queue {} (hwm {})".format(
+            rates["packets_in"], rates["messages_out"], report["totals"]["errors"], report["shed"],
+            report["depth"], report["high_water"]
+        )
+
+        for stage in STAGES:
+            count, p50, p99, peak = report["latency"][stage]
+
+            if count:
+                line += " | {} p50 {:.0f}us p99 {:.0f}us max {:.0f}us".format(stage, p50 * 1e6, p99 * 1e6, peak * 1e6)
+
+        totals = report["totals"]
+
+        for name in report["trackers"]:
+            if totals[name + "_received"]:
+                line += " | {} seq dup {} gap {} late {} reset {}".format(
+                    name, totals[name + "_duplicates"], totals[name + "_gaps"], totals[name + "_reorders"],
+                    totals[name + "_resets"]
+                )
+
+        return line
+
+    @staticmethod
+    def encode(report):
+        bundle = OSC.OSCBundle(Reporter.ADDRESS)
+        rates = report["rates"]
+        totals = report["totals"]
+
+        for name in sorted(totals):
+            bundle.append({'addr': "{}/{}".format(Reporter.ADDRESS, name), 'args': [totals[name], float(rates[name])]})
+
+        bundle.append({'addr': Reporter.ADDRESS + "/queue", 'args': [report["depth"], report["high_water"], report["shed"]]})
+
+        for stage in STAGES:
+            count, p50, p99, peak = report["latency"][stage]
+            bundle.append({'addr': "{}/latency/{}".format(Reporter.ADDRESS, stage),
+                           'args': [count, p50 * 1e6, p99 * 1e6, peak * 1e6]})
+
+        return bundle.getBinary()